@@ -0,0 +1,60 @@
+"""
+Submission counts for the faculty dashboard.
+
+The submission_counts table holds one row per form, status, branch,
+semester, section and event level, kept current by triggers (migration 8).
+The dashboard sums those rows, so it costs as much as the number of groups
+whatever the number of submissions. rebuild_counts() recounts everything
+from submissions to check the triggers and repair the table.
+"""
+
+# Columns counts can be grouped and filtered by
+COUNT_DIMENSIONS = ("form_key", "status", "branch", "semester", "section", "event_level")
+
+RECOUNT_SQL = """
+    SELECT s.form_key, s.status, sd.branch, sd.semester, sd.section,
+        COALESCE(json_extract(s.fields, '$.event_level'), '') AS event_level, COUNT(*) AS count
+    FROM submissions AS s JOIN student_details AS sd ON sd.student_user_id = s.student_id
+    GROUP BY s.form_key, s.status, sd.branch, sd.semester, sd.section, event_level
+"""
+
+
+def get_counts(db, group_by, filters):
+    """
+    Sums of submission_counts grouped by the group_by columns, with
+    filters {column: value} applied. Both only use COUNT_DIMENSIONS.
+    """
+    where_list = [f"{column} = ?" for column in filters]
+    where_sql = f"WHERE {' AND '.join(where_list)}" if where_list else ""
+    columns_sql = ", ".join(group_by)
+
+    sql = f"SELECT {columns_sql + ', ' if group_by else ''}SUM(count) AS count FROM submission_counts {where_sql}"
+    if group_by:
+        sql += f" GROUP BY {columns_sql} ORDER BY {columns_sql}"
+    return db.execute(sql, *filters.values())
+
+
+def rebuild_counts(db, repair=True):
+    """
+    Recounts submissions and compares with submission_counts.
+    Returns the groups that differ as (group, stored count, actual count),
+    and with repair replaces the table with the recount, in one transaction.
+    """
+    with db.transaction() as connection:
+        stored = {
+            tuple(row[:-1]): row[-1]
+            for row in connection.execute(f"SELECT {', '.join(COUNT_DIMENSIONS)}, count FROM submission_counts")
+        }
+        actual = {tuple(row[:-1]): row[-1] for row in connection.execute(RECOUNT_SQL)}
+
+        differences = [
+            (dict(zip(COUNT_DIMENSIONS, group)), stored.get(group, 0), actual.get(group, 0))
+            for group in sorted(stored.keys() | actual.keys(), key=str)
+            if stored.get(group, 0) != actual.get(group, 0)
+        ]
+
+        if repair and differences:
+            connection.execute("DELETE FROM submission_counts")
+            connection.execute(f"INSERT INTO submission_counts {RECOUNT_SQL}")
+
+    return differences
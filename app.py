@@ -1,43 +1,108 @@
-from authlib.integrations.flask_client import OAuth
-from cs50 import SQL
+import time
+
+# Worker cold-start time is measured from here, imports included
+startup_started = time.perf_counter()
+
+from aggregates import COUNT_DIMENSIONS, get_counts, rebuild_counts
+from assets import StaticAssets
+from cache import TTLCache
 from config import Config
+from database import Database
 from datetime import datetime
-from flask import Flask, flash, redirect, render_template, request, session, url_for, jsonify
+from drive_queue import DriveUploader, LocalUploader, UploadWorkerPool, enqueue, reuse_upload
+from export import iter_csv, iter_rows, iter_xlsx, iter_zip
+from flask import Flask, Response, flash, g, redirect, render_template, request, session, stream_with_context, url_for, jsonify
 from flask_session import Session
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from werkzeug.security import check_password_hash, generate_password_hash
+from functools import wraps
+from fragments import FragmentCache, definition_hash
+from hashing import PasswordHasher, PasswordHasherBusy
+from importer import MappingError, import_csv, load_mapping
+from jinja2 import FileSystemBytecodeCache
+from journal import CSVJournal
+from logs import configure_logging
+from markupsafe import Markup
+from metrics import BYTES_BUCKETS, CONTENT_TYPE, Metrics, RequestTimer
+from migrations import migrate
+from search import search_submissions
+from sessions import SQLiteSessionInterface
+from storage import discard_upload, prune_blobs, release_upload, remove_partial_uploads, save_upload
+from uploads import UploadRequest, upload_limits
+from validators import compile_forms, stored_value
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import csv
+import atexit
+import click
+import contextlib
+import json
+import logging
 import os
+import sqlite3
 
 app = Flask(__name__)
 app.config.from_object(Config)
-Session(app)
 
 app.secret_key = app.config["SECRET_KEY"]
 
+# Structured logs, below LOG_LEVEL they cost a level check
+configure_logging(app.config["LOG_LEVEL"])
+log = logging.getLogger("sodeca.app")
+
+# Set before the first template is loaded
+if app.config["JINJA_BYTECODE_CACHE"]:
+    if app.config["JINJA_BYTECODE_CACHE_DIR"]:
+        os.makedirs(app.config["JINJA_BYTECODE_CACHE_DIR"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_BYTECODE_CACHE_DIR"])
+
+# Hashed, precompressed static files once "python assets.py" has built them
+assets = StaticAssets(app)
+
 GOOGLE_CLIENT_ID = app.config["GOOGLE_CLIENT_ID"]
 GOOGLE_CLIENT_SECRET = app.config["GOOGLE_CLIENT_SECRET"]
-# OAuth Setup
-oauth = OAuth(app)
-google = oauth.register(
-    name='google',
-    client_id=app.config['GOOGLE_CLIENT_ID'],
-    client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_kwargs={'scope': 'openid email profile'},
-)
+# OAuth Setup, done on the first Google login instead of at startup
+# Importing authlib takes a good part of the worker's boot time
+google = None
+def get_google():
+    """Returns the Google OAuth client, registering it on first use."""
+    global google
+    if google is None:
+        from authlib.integrations.flask_client import OAuth
+        from oidc import OIDCApp
+
+        oauth = OAuth(app)
+        google = oauth.register(
+            name='google',
+            client_cls=OIDCApp,
+            client_id=app.config['GOOGLE_CLIENT_ID'],
+            client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+            server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
+            client_kwargs={'scope': 'openid email profile'},
+            metadata_ttl=app.config['OIDC_METADATA_TTL'],
+            jwks_ttl=app.config['OIDC_JWKS_TTL'],
+            jwks_min_refresh=app.config['OIDC_JWKS_MIN_REFRESH'],
+        )
+    return google
+
+# Password hashing runs on a small process pool, so logins can't hold every worker
+password_hasher = PasswordHasher(
+    method=app.config["PASSWORD_HASH_METHOD"], workers=app.config["PASSWORD_HASH_WORKERS"],
+    max_pending=app.config["PASSWORD_HASH_MAX_PENDING"], timeout=app.config["PASSWORD_HASH_TIMEOUT"]
+    )
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """Too many logins at once, ask the browser to come back shortly."""
+    return "Too many logins right now, please try again in a few seconds.", 503, {"Retry-After": "5"}
 
 # To upload certificates
 UPLOAD_FOLDER = app.config["UPLOAD_FOLDER"]
-# Allowed extensions for the certificate upload
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Allowed extensions for the certificate upload, when a form doesn't set accepted_types
 ALLOWED_EXTENSIONS = app.config["ALLOWED_EXTENSIONS"]
-def allowed_file(filename):
-    """Checks if the file extension is allowed."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Uploaded files past a small size are spooled to disk while the body is parsed
+UploadRequest.spool_threshold = app.config["UPLOAD_SPOOL_THRESHOLD"]
+UploadRequest.spool_folder = app.config["UPLOAD_SPOOL_DIR"]
+app.request_class = UploadRequest
 
 # Form Fields Defined
 FORM_DEFINITIONS = {
@@ -273,6 +338,45 @@ FORM_DEFINITIONS = {
     }
 }
 
+# Checks of every form, compiled once from FORM_DEFINITIONS
+FORM_VALIDATORS = compile_forms(FORM_DEFINITIONS, ALLOWED_EXTENSIONS)
+
+# Largest body a submission of each form can need, enforced while it streams
+FORM_UPLOAD_LIMITS = upload_limits(
+    FORM_DEFINITIONS, app.config["UPLOAD_MAX_SIZE"], app.config["UPLOAD_FORM_OVERHEAD"]
+    )
+# No other route takes bigger bodies
+if app.config["MAX_CONTENT_LENGTH"] is None:
+    app.config["MAX_CONTENT_LENGTH"] = max(FORM_UPLOAD_LIMITS.values())
+
+@app.before_request
+def limit_upload_size():
+    """Caps a form submission at its form's limit, before its body is read."""
+    if request.endpoint == "fill_form" and request.method == "POST":
+        selected_forms = session.get("selected_forms") or []
+        index = session.get("current_form_index", 0)
+        if index < len(selected_forms) and selected_forms[index] in FORM_UPLOAD_LIMITS:
+            request.max_content_length = FORM_UPLOAD_LIMITS[selected_forms[index]]
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Body over the limit, refused without reading the rest of it."""
+    limit = request.max_content_length
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("sodeca_uploads_rejected_total", (("route", route),))
+    return f"Upload too large, submissions can be at most {limit // (1024 * 1024)}MB.", 413
+
+# Rendered form fields, keyed by the hash of each form's definition
+# Not cached while templates reload on change (debug mode)
+FORM_HASHES = {form: definition_hash(definition) for form, definition in FORM_DEFINITIONS.items()}
+fragments = FragmentCache(app.config["FRAGMENT_CACHE"] and not app.jinja_env.auto_reload)
+
+def render_form_body(form, values=None):
+    """Fields of a form, rendered once unless they are prefilled with values."""
+    if values:
+        return Markup(render_template("partials/form_body.html", form_to_show=FORM_DEFINITIONS[form], values=values))
+    return fragments.render("partials/form_body.html", FORM_HASHES[form], form_to_show=FORM_DEFINITIONS[form])
+
 # List of technical names of forms defined
 form_name_list = FORM_DEFINITIONS.keys()
 
@@ -286,57 +390,300 @@ with open(db_path, 'a'):
     pass  
 
 # Database configuration
-db = SQL(f"sqlite:///{db_path}")
-# Initialise some required tables, when app is loaded for the first time
-# Initialise table to store student login details
-db.execute("""
-    CREATE TABLE IF NOT EXISTS students (user_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, 
-    email TEXT UNIQUE NOT NULL, hash_password TEXT, google_id TEXT UNIQUE, 
-    auth_provider TEXT DEFAULT 'local' NOT NULL, profile_picture TEXT, 
-    first_name TEXT, last_name TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, 
-    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)
-""")    
-# Initialise table to store student details
-db.execute("""
-    CREATE TABLE IF NOT EXISTS student_details(student_user_id INTEGER PRIMARY KEY NOT NULL, 
-    university_roll_no TEXT NOT NULL, student_name TEXT NOT NULL, branch TEXT NOT NULL, 
-    semester INTEGER NOT NULL, section TEXT NOT NULL, class_group TEXT NOT NULL, 
-    batch_counselor TEXT NOT NULL, FOREIGN KEY (student_user_id) REFERENCES students(user_id))
-""")
-# Create tables for all the forms in FORM_DEFINITIONS
-# Iterate through all forms defined
-for form in form_name_list:
-
-    # Check if table named the form exists
-    table_exists = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", form)
-
-    # If not exists
-    if not table_exists:
-
-        # List to store differnet fields definition
-        col_def_list = []
-        for field_col in FORM_DEFINITIONS[form]["fields"]:
-
-            field_col_name = field_col["field_name"]
-
-            # Defining form fields with dataype TEXT and is REQUIRED
-            col_def = f"{field_col_name} TEXT NOT NULL" 
-            col_def_list.append(col_def)       
-
-        # SQL string
-        field_cols_sql = ",".join(col_def_list)
-
-        # Dynamically create SQL tables for all forms
-        db.execute(
-            f"""CREATE TABLE IF NOT EXISTS {form}(
-            student_id INTEGER PRIMARY KEY NOT NULL,
-            {field_cols_sql},
-            status TEXT DEFAULT 'pending' NOT NULL, 
-            FOREIGN KEY (student_id) REFERENCES student_details(student_user_id),
-            CHECK (status IN ('pending', 'approved', 'rejected'))
-            )"""
+# One connection per worker thread, WAL so readers don't block writers
+db = Database(
+    db_path, busy_timeout=app.config["SQLITE_BUSY_TIMEOUT"], synchronous=app.config["SQLITE_SYNCHRONOUS"],
+    busy_retries=app.config["SQLITE_BUSY_RETRIES"], busy_backoff=app.config["SQLITE_BUSY_BACKOFF"],
+    optimize_interval=app.config["SQLITE_OPTIMIZE_INTERVAL"]
+    )
+# Sessions are kept in the database, expired ones are swept in the background
+if app.config["SESSION_TYPE"] == "sqlite":
+    app.session_interface = SQLiteSessionInterface(
+        app, db, permanent=app.config["SESSION_PERMANENT"],
+        cache_ttl=app.config["SESSION_CACHE_TTL"], cache_size=app.config["SESSION_CACHE_SIZE"],
+        refresh_after=app.config["SESSION_REFRESH_AFTER"],
+        sweep_interval=app.config["SESSION_SWEEP_INTERVAL"], sweep_batch=app.config["SESSION_SWEEP_BATCH"]
+        )
+else:
+    Session(app)
+
+# Upload certificates to Google Drive in the background
+if app.config["DRIVE_UPLOADER"] == "drive":
+    uploader = DriveUploader(
+        app.config["GOOGLE_SERVICE_ACCOUNT_FILE"], app.config["DRIVE_FOLDER_ID"], app.config["DRIVE_CHUNK_SIZE"]
+        )
+elif app.config["DRIVE_UPLOADER"] == "local":
+    uploader = LocalUploader(app.config["DRIVE_LOCAL_FOLDER"])
+else:
+    # Jobs stay queued until an uploader is configured
+    uploader = None
+
+upload_pool = None
+if uploader and app.config["DRIVE_UPLOAD_WORKERS"] > 0:
+    upload_pool = UploadWorkerPool(
+        db, uploader, workers=app.config["DRIVE_UPLOAD_WORKERS"],
+        max_attempts=app.config["DRIVE_UPLOAD_MAX_ATTEMPTS"]
         )
 
+# Latency, SQL statements and uploads of every request, served at /metrics
+metrics = Metrics(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"])
+request_timer = RequestTimer(app, metrics, db)
+metrics.counter("sodeca_upload_bytes_total", "Bytes of certificates stored, by form.")
+metrics.histogram("sodeca_upload_size_bytes", "Size of each stored certificate, by form.", BYTES_BUCKETS)
+metrics.counter("sodeca_uploads_rejected_total", "Request bodies refused for being over their limit.")
+metrics.counter("sodeca_duplicate_certificates_total", "Certificates with the same bytes as an earlier one, by form.")
+
+# Counters kept by the database layer, the password hasher and the session store, read when scraped
+DB_COUNTERS = {
+    "statements": ("sodeca_db_statements_total", "Statements run, including retries' successes."),
+    "busy_retries": ("sodeca_db_busy_retries_total", "Statements retried after SQLITE_BUSY."),
+    "busy_errors": ("sodeca_db_busy_errors_total", "Statements that failed with SQLITE_BUSY."),
+    "lock_wait_seconds": ("sodeca_db_lock_wait_seconds_total", "Time spent waiting on SQLite locks."),
+}
+SESSION_COUNTERS = {
+    "loads": ("sodeca_session_loads_total", "Sessions loaded."),
+    "load_seconds": ("sodeca_session_load_seconds_total", "Time spent loading sessions."),
+    "cache_hits": ("sodeca_session_cache_hits_total", "Sessions loaded from the in-process cache."),
+    "saves": ("sodeca_session_saves_total", "Sessions written."),
+    "save_seconds": ("sodeca_session_save_seconds_total", "Time spent writing sessions."),
+    "saves_skipped": ("sodeca_session_saves_skipped_total", "Unchanged sessions not written."),
+}
+
+def stats_collector(source, counters):
+    """Collector reading source.stats, under its lock, as the given counters."""
+    for name, help_text in counters.values():
+        metrics.counter(name, help_text)
+
+    def collect():
+        with source.stats_lock:
+            stats = dict(source.stats)
+        return [(name, (), stats[key]) for key, (name, help_text) in counters.items()]
+    return collect
+
+PASSWORD_HASH_COUNTERS = {
+    "hashes": ("sodeca_password_hashes_total", "Password hashes and checks done."),
+    "hash_seconds": ("sodeca_password_hash_seconds_total", "Time spent hashing, in the pool processes."),
+    "queue_wait_seconds": ("sodeca_password_hash_queue_wait_seconds_total", "Time hashes waited for a pool process."),
+    "rejected": ("sodeca_password_hashes_rejected_total", "Hashes refused with a 503, too many were waiting."),
+    "rehashed": ("sodeca_password_rehashes_total", "Outdated hashes replaced on login."),
+}
+
+metrics.collect(stats_collector(db, DB_COUNTERS))
+metrics.collect(stats_collector(password_hasher, PASSWORD_HASH_COUNTERS))
+if app.config["SESSION_TYPE"] == "sqlite":
+    metrics.collect(stats_collector(app.session_interface, SESSION_COUNTERS))
+
+# Allowed values of the status column, same as the CHECK on submissions
+SUBMISSION_STATUSES = ("pending", "approved", "rejected")
+# What faculty can set a submission to
+DECISION_STATUSES = ("approved", "rejected")
+
+# Filters faculty can apply on submissions, mapped to their SQL columns
+# Only these keys are ever put into a query, so user input never becomes SQL
+SUBMISSION_FILTERS = {
+    "status": "s.status",
+    "branch": "sd.branch",
+    "semester": "sd.semester",
+    "section": "sd.section",
+    "class_group": "sd.class_group",
+    "batch_counselor": "sd.batch_counselor",
+}
+
+def get_submission_filters(args):
+    """Returns the submission filters present in the request args."""
+    filters = {}
+    for key in SUBMISSION_FILTERS:
+        value = args.get(key)
+        if value:
+            filters[key] = value
+    return filters
+
+def build_submission_query(form, filters, after=None, limit=None):
+    """
+    Builds the SELECT for one form's submissions joined with student details,
+    with a column per field of the form. With form None every form is read
+    and the fields stay one JSON column.
+    Rows are ordered by submission_id so "after" works as a keyset cursor.
+    Returns (sql, params).
+    """
+    where_list = []
+    params = []
+
+    if form is not None:
+        where_list.append("s.form_key = ?")
+        params.append(form)
+        field_sql = "".join(
+            f"json_extract(s.fields, '$.{field['field_name']}') AS {field['field_name']}, "
+            for field in FORM_DEFINITIONS[form]["fields"]
+        )
+    else:
+        field_sql = "s.form_key, s.fields, "
+
+    for key, value in filters.items():
+        where_list.append(f"{SUBMISSION_FILTERS[key]} = ?")
+        params.append(value)
+
+    # Keyset cursor, continue right after the last row of the previous page
+    if after is not None:
+        where_list.append("s.submission_id > ?")
+        params.append(after)
+
+    where_sql = f"WHERE {' AND '.join(where_list)}" if where_list else ""
+
+    # upload_status is the Google Drive upload state of the certificate,
+    # duplicate_of the submission that first sent the same certificate
+    sql = f"""
+        SELECT s.submission_id, s.student_id, {field_sql}s.status, s.created_at,
+            sd.university_roll_no, sd.student_name, sd.branch, sd.semester,
+            sd.section, sd.class_group, sd.batch_counselor,
+            (SELECT c.drive_status FROM certificates AS c WHERE c.submission_id = s.submission_id
+             ORDER BY c.certificate_id DESC LIMIT 1) AS upload_status,
+            (SELECT d.submission_id FROM certificates AS c JOIN certificates AS d ON d.certificate_id = c.duplicate_of
+             WHERE c.submission_id = s.submission_id ORDER BY c.certificate_id DESC LIMIT 1) AS duplicate_of
+        FROM submissions AS s
+        JOIN student_details AS sd ON sd.student_user_id = s.student_id
+        {where_sql}
+        ORDER BY s.submission_id
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return sql, params
+
+def build_certificate_query(form, filters):
+    """
+    Builds the SELECT for the certificates of the submissions matching the
+    filters, of one form or of every form with form None, ordered by roll
+    number and form. Returns (sql, params).
+    """
+    where_list = []
+    params = []
+
+    if form is not None:
+        where_list.append("c.form = ?")
+        params.append(form)
+
+    for key, value in filters.items():
+        where_list.append(f"{SUBMISSION_FILTERS[key]} = ?")
+        params.append(value)
+
+    where_sql = f"WHERE {' AND '.join(where_list)}" if where_list else ""
+
+    sql = f"""
+        SELECT sd.university_roll_no, c.form, c.file_name, c.path
+        FROM certificates AS c
+        JOIN submissions AS s ON s.submission_id = c.submission_id
+        JOIN student_details AS sd ON sd.student_user_id = s.student_id
+        {where_sql}
+        ORDER BY sd.university_roll_no, c.form, c.certificate_id
+    """
+    return sql, params
+
+def certificate_entries(rows):
+    """
+    (entry name, path) for every certificate row, named roll_form.pdf.
+    Later certificates of the same student and form get _2, _3...
+    """
+    entries = []
+    seen = {}
+    for row in rows:
+        name = secure_filename(f"{row['university_roll_no']}_{row['form']}")
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name}_{seen[name]}"
+        entries.append((f"{name}{os.path.splitext(row['file_name'])[1].lower()}", row["path"]))
+    return entries
+
+def get_submissions_page(form, filters, after=None, limit=None):
+    """
+    Returns one page of a form's submissions, or of every form's with
+    form None, as (rows, next_cursor).
+    next_cursor is None when there are no more rows.
+    """
+    if limit is None:
+        limit = app.config["SUBMISSIONS_PAGE_SIZE"]
+    limit = max(1, min(limit, app.config["SUBMISSIONS_MAX_PAGE_SIZE"]))
+
+    # Ask for one extra row, to know if there is a next page
+    sql, params = build_submission_query(form, filters, after, limit + 1)
+    rows = db.execute(sql, *params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["submission_id"]
+
+    return rows, next_cursor
+
+# Student details shared across requests for a short time, keyed by user_id
+student_details_cache = TTLCache(
+    app.config["STUDENT_DETAILS_CACHE_TTL"], app.config["STUDENT_DETAILS_CACHE_SIZE"]
+    )
+
+def get_student_details(user_id):
+    """
+    Returns the student_details row of a user as a dict, None if not filled yet.
+    Read at most once per request, and once per TTL across requests.
+    """
+    # Memoized for the current request
+    request_cache = g.setdefault("student_details", {})
+    if user_id in request_cache:
+        return request_cache[user_id]
+
+    details = student_details_cache.get(user_id)
+    if details is None:
+        rows = db.execute("SELECT * FROM student_details WHERE student_user_id = ?", user_id)
+        details = rows[0] if rows else None
+        # Students without details will fill them soon, so they aren't cached
+        if details is not None:
+            student_details_cache.set(user_id, details)
+
+    request_cache[user_id] = details
+    return details
+
+def invalidate_student_details(user_id):
+    """Drops cached details of a user, after they are changed."""
+    student_details_cache.pop(user_id)
+    g.get("student_details", {}).pop(user_id, None)
+
+def update_statuses(updates):
+    """
+    Changes the status of many submissions in one transaction.
+    updates is a list of (submission_id, status).
+    Returns the rows whose status changed, nothing is changed on error.
+    """
+    new_statuses = dict(updates)
+    changed = []
+
+    # Takes the write lock at the start, so the rows can't change before the update
+    with db.transaction() as connection:
+
+        submission_ids = list(new_statuses)
+        placeholder_sql = ",".join(["?"] * len(submission_ids))
+        current = connection.execute(
+            f"SELECT submission_id, student_id, form_key, status FROM submissions "
+            f"WHERE submission_id IN ({placeholder_sql})", submission_ids
+        ).fetchall()
+
+        # Skip missing rows and rows already in the asked status
+        to_update = []
+        for row in current:
+            status = new_statuses[row["submission_id"]]
+            if row["status"] != status:
+                to_update.append((status, row["submission_id"]))
+                changed.append({
+                    "submission_id": row["submission_id"], "form_name": row["form_key"],
+                    "student_id": row["student_id"], "status": status, "previous_status": row["status"],
+                })
+
+        db.executemany(
+            "UPDATE submissions SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE submission_id = ?",
+            to_update
+        )
+
+    return changed
+
 # Register
 @app.route("/", methods=["GET", "POST"])
 def register():
@@ -368,6 +715,11 @@ def register():
             # Flash error message
             return redirect("/")
         
+        # Faculty accounts are only made through Google, which checks the address is theirs
+        if email.strip().lower() in app.config["FACULTY_EMAILS"]:
+            flash("Faculty sign in with Google", "error")
+            return redirect("/login")
+
         # Check if email already exists
         existing_student = db.execute("SELECT * FROM students WHERE email = ?", email)
         if existing_student:
@@ -376,16 +728,8 @@ def register():
         
         # If form was filled successfully
         # Convert plain password into a complex string 
-        hash_password = generate_password_hash(password)
+        hash_password = password_hasher.generate(password)
 
-        # Create "students" table if it is not there
-        db.execute(
-            "CREATE TABLE IF NOT EXISTS students (" \
-            "user_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, email TEXT UNIQUE NOT NULL, " \
-            "hash_password TEXT, google_id TEXT UNIQUE, auth_provider TEXT DEFAULT 'local' NOT NULL, " \
-            "profile_picture TEXT, first_name TEXT, last_name TEXT, " \
-            "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
-            )
         # Store Student's login details in the table
         db.execute(
             "INSERT INTO students (email, hash_password) VALUES (?, ?)", email, hash_password 
@@ -397,7 +741,7 @@ def register():
 @app.route("/auth/google")
 def google_login():
     redirect_uri = url_for('callback', _external=True)
-    return google.authorize_redirect(redirect_uri)
+    return get_google().authorize_redirect(redirect_uri)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -420,12 +764,23 @@ def login():
             "SELECT * FROM students WHERE email=? AND auth_provider = 'local'", email
             )
         
-        if len(rows) != 1 or not check_password_hash(
+        if len(rows) != 1 or not password_hasher.check(
             rows[0]["hash_password"], password
             ):
             flash("Fill your student details before login.")
             return redirect("/student_details")
 
+        # Hash made with older parameters, replace it now that we know the password
+        # Best effort, with the pool busy it is tried again on the next login
+        if password_hasher.needs_rehash(rows[0]["hash_password"]):
+            try:
+                db.execute(
+                    "UPDATE students SET hash_password = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+                    password_hasher.rehash(password), rows[0]["user_id"]
+                    )
+            except (PasswordHasherBusy, TimeoutError):
+                log.warning("password rehash skipped", extra={"fields": {"user_id": rows[0]["user_id"]}})
+
         # Remember the user if login was successful
         session["user_id"] = rows[0]["user_id"]
         session["auth_provider"] = "local"
@@ -438,11 +793,10 @@ def login():
 def callback():
     """Handle Google OAuth callback"""
     try:
-        token = google.authorize_access_token()
+        token = get_google().authorize_access_token()
 
-        user_info_url = 'https://openidconnect.googleapis.com/v1/userinfo'
-        resp = google.get(user_info_url, token=token)
-        user_info = resp.json()
+        # Claims of the id_token, verified against Google's cached signing keys
+        user_info = token.get('userinfo')
         
         if user_info:
             google_id = user_info['sub']
@@ -551,17 +905,6 @@ def student_details():
             
             # If all entries are filled successfuly
             
-            # Create student_details table if not there
-            # roll no. columns is not unique because if one student makes any mistake
-            # that will create hurdles for others
-            db.execute(
-                "CREATE TABLE IF NOT EXISTS student_details(student_user_id INTEGER PRIMARY KEY NOT NULL, " \
-                "university_roll_no TEXT NOT NULL, student_name TEXT NOT NULL, branch TEXT NOT NULL, " \
-                "semester INTEGER NOT NULL, section TEXT NOT NULL, class_group TEXT NOT NULL, " \
-                "batch_counselor TEXT NOT NULL, FOREIGN KEY (student_user_id) " \
-                "REFERENCES students(user_id))"
-                )
-            
             # Store detail using UPSERT query
             # The corrected and robust "UPSERT" command
             db.execute(
@@ -583,20 +926,17 @@ def student_details():
                 session["user_id"], university_roll_no, student_name, selected_branch, 
                 selected_semester, selected_section, selected_group, batch_counselor
             )
+            invalidate_student_details(session["user_id"])
 
             return redirect("/sodeca_forms") 
          
         else:
 
             # Get student details if already present
-            # Variable stores a list of dictionaries 
-            student_details_row = db.execute(
-                "SELECT * FROM student_details WHERE student_user_id = ?", session["user_id"]
-            ) 
+            filled_details = get_student_details(session["user_id"])
 
             # If details are already available
-            if student_details_row:
-                filled_details = student_details_row[0]
+            if filled_details:
 
                 # Show the page with filled details
                 return render_template(
@@ -635,8 +975,11 @@ def verify_student_details():
             verified_details = request.form.get("verified_details")
             session["verified_details"] = verified_details
 
-            print(f"Verified: {verified_details}")
-            
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("details verified", extra={"fields": {
+                    "user_id": session["user_id"], "verified": verified_details,
+                    }})
+
             if verified_details == None:
                 flash("Kindly confirm details by checking the checkbox", "warning")
                 return redirect("/verify_student_details")
@@ -644,14 +987,10 @@ def verify_student_details():
                 return redirect("/fill_form")
         else:
             # Get student details if already present
-            # Variable stores a list of dictionaries 
-            student_details_row = db.execute(
-                        "SELECT * FROM student_details WHERE student_user_id = ?", session["user_id"]
-                        ) 
+            filled_details = get_student_details(session["user_id"])
             
             # If details are already available
-            if student_details_row:
-                filled_details = student_details_row[0]
+            if filled_details:
 
                 # Show the page with filled details
                 return render_template("verify_student_details.html", details = filled_details)
@@ -697,119 +1036,141 @@ def fill_form():
 
         if request.method == "POST":
 
-            # Check if certificate was submitted
-            if 'certificate' not in request.files:
-                flash("No file part", "danger")
-                return redirect(request.url)
+            # Validate every field in one pass, collecting all errors
+            values, errors = FORM_VALIDATORS[current_form].validate(request.form, request.files)
+            if errors:
+                for error in errors:
+                    flash(f"Submission Failed: {error}", "danger")
+                # Show the form again with what the student already entered
+                return render_template(
+                    "fill_form.html", success=False, form_to_show=form_to_show,
+                    form_body=render_form_body(current_form, request.form)
+                    )
 
-            # Dict for text and radio inputs
+            # Values to store, {field_name: value}
             form_inputs = {}
+
+            # Uploaded files to store, {field_name: FileStorage}
+            uploads = {}
             
             # Iterating through all input fields
             for field in form_to_show["fields"]:
 
-                field_title = field["field_label"]
                 field_name = field["field_name"]
                 field_type = field["field_type"]
-                
-                # If input field is a date
-                if field_type == "date":
-                    date_string = request.form.get(field_name)
-                    
-                    try:
-                        # Parse the date string into a datetime object
-                        date_object = datetime.strptime(date_string, '%Y-%m-%d').date()
 
-                        # TODO: Error checking using "date_object" 
-                        
-                        # After succesful parsing only, Append in dict form_inputs
-                        form_inputs[field_name] = date_string
-
-                    except ValueError:
-                        flash("Invalid date format submitted.")
-                        return redirect(request.url)
+                # Optional field left empty
+                if field_name not in values:
+                    form_inputs[field_name] = ""
                     
                 elif field_type == "file": 
 
-                    # As certificate is required in every form
-                    certificate = request.files[field_name]
-
-                    # Check if the user selected a file
-                    if certificate.filename == "":
-                        flash("No selected file", "danger")
-                        return redirect(request.url)
-                    
-                    # Check if file is valid and has an allowed extension
-                    if certificate and allowed_file(certificate.filename):
-
-                        # Get student_name and unversity_roll_no
-                        student_details = db.execute(
-                            """SELECT university_roll_no, student_name FROM 
-                            student_details WHERE student_user_id = ?""", session["user_id"]
-                        )
-
-                        # Get file extension eg. ".pdf"
-                        file_extension = os.path.splitext(certificate.filename)[1]
-
-                        # Rename the file in format universityroll_studentname_eventname
-                        uni_roll_no = student_details[0]["university_roll_no"]
-                        student_name = student_details[0]["student_name"]
-                        event_name = request.form.get("event_title", "unknown_event")
+                    certificate = values[field_name]
 
-                        certificate.filename =  f"{uni_roll_no}_{student_name}_{event_name}{file_extension}"
+                    # Get student_name and unversity_roll_no
+                    student_details = get_student_details(session["user_id"])
 
-                        # Secure the filename to prevent security risks (e.g., directory traversal)
-                        filename = secure_filename(certificate.filename)
+                    # Get file extension eg. ".pdf"
+                    file_extension = os.path.splitext(certificate.filename)[1]
 
-                        # Save filename in form_inputs
-                        form_inputs[field_name] = filename 
+                    # Rename the file in format universityroll_studentname_eventname_time
+                    # Students can submit a form many times, the time keeps the names apart
+                    uni_roll_no = student_details["university_roll_no"]
+                    student_name = student_details["student_name"]
+                    event_name = request.form.get("event_title", "unknown_event")
+                    submitted_at = datetime.now().strftime("%Y%m%d%H%M%S")
 
-                        # TODO: Upload certificate to G-Drive
+                    certificate.filename =  f"{uni_roll_no}_{student_name}_{event_name}_{submitted_at}{file_extension}"
 
-                        # Print file name if saved
-                        print(f"File named: {filename} saved successfully!")
+                    # Secure the filename to prevent security risks (e.g., directory traversal)
+                    filename = secure_filename(certificate.filename)
 
-                    else:
+                    # Save filename in form_inputs
+                    form_inputs[field_name] = filename 
+                    uploads[field_name] = certificate
 
-                        flash("Invalid file type. Allowed types are: pdf", "danger")
-                        return redirect(request.url)
-
-                # Text and Radio inputs
+                # Text, number, radio and date inputs, dates stored as YYYY-MM-DD
                 else: 
-                    # Update form_inputs dict
-                    form_inputs[field_name] = request.form.get(field_name)
-
-                    # If any input is missing
-                    if not form_inputs[field_name]:
-                        # flash error
-                        flash(f"Submission Failed: {field_title} is missing!", "danger")
-                        return redirect(request.url)
-                    
-                    # Debugging
-                    print(f"{field_title}: {form_inputs[field_name]}")                    
-
-                    # TODO: Error Handling
-
-            # If everything went good
-            # Make a list of inputs separated by ","
-            form_fields = form_inputs.keys()
-            form_fields_sql = ",".join(form_fields)
-
-            # eg. "?,?,?..."
-            placeholder_sql = ",".join(["?"]*len(form_inputs))
-
-            # eg. ["Value1", "Value2"...]
-            values_list = list(form_inputs.values())
-
-            # eg. "field1 = excluded.field1, field2 = excluded.field2..." 
-            update_clause = ", ".join([f"{field} = excluded.{field}" for field in form_fields])
+                    form_inputs[field_name] = stored_value(values[field_name])
+
+            # Store uploaded files on disk, before the transaction so it stays short
+            stored_files = {}
+            try:
+                for field_name, upload in uploads.items():
+                    stored_files[field_name] = save_upload(db, upload, UPLOAD_FOLDER, app.config["UPLOAD_CHUNK_SIZE"])
+
+                # Certificate ids of earlier certificates with the same bytes, {field_name: certificate_id}
+                duplicates = {}
+
+                # The entry and its certificates are stored together, a new entry on every submission
+                with db.transaction():
+                    submission_id = db.execute(
+                        "INSERT INTO submissions (student_id, form_key, fields) VALUES (?, ?, ?)",
+                        session["user_id"], current_form, json.dumps(form_inputs)
+                    )
 
-            # Dynamically store form entries in respective tables in database
-            db.execute(f"""
-                INSERT INTO {current_form} (student_id, {form_fields_sql}, status) 
-                VALUES(?, {placeholder_sql}, ?)
-                ON CONFLICT(student_id) DO UPDATE SET {update_clause} 
-            """, session["user_id"], *values_list, 'pending') # *values_list gives a string eg. "Value1", "Value2"...
+                    for field_name, stored in stored_files.items():
+                        # First certificate with these bytes, through idx_certificates_sha256
+                        original = db.execute(
+                            """
+                            SELECT c.certificate_id, c.drive_file_id, b.path FROM certificates AS c
+                            JOIN certificate_blobs AS b ON b.sha256 = c.sha256
+                            WHERE c.sha256 = ? ORDER BY c.certificate_id LIMIT 1
+                            """,
+                            stored["sha256"]
+                        )
+                        original = original[0] if original else None
+                        path = stored["path"]
+                        if original:
+                            duplicates[field_name] = original["certificate_id"]
+                            if original["path"] != path:
+                                # Stored before certificates were named by hash, keep using that file
+                                if stored["created"]:
+                                    with contextlib.suppress(FileNotFoundError):
+                                        os.remove(path)
+                                path = original["path"]
+
+                        certificate_id = db.execute(
+                            """
+                            INSERT INTO certificates
+                                (submission_id, student_id, form, file_name, path, size, sha256, duplicate_of)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            submission_id, session["user_id"], current_form, form_inputs[field_name],
+                            path, stored["size"], stored["sha256"], duplicates.get(field_name)
+                        )
+                        # Counted by the certificate now
+                        release_upload(db, stored)
+
+                        if original and original["drive_file_id"]:
+                            # Already on Google Drive, no second copy there either
+                            reuse_upload(db, certificate_id, original["drive_file_id"])
+                        else:
+                            # Upload to Google Drive later, in the background
+                            enqueue(db, certificate_id, path, form_inputs[field_name])
+
+            except BaseException:
+                # The submission wasn't stored, give back the files' references
+                for stored in stored_files.values():
+                    try:
+                        discard_upload(db, stored)
+                    except Exception:
+                        log.warning("upload not removed", exc_info=True, extra={"fields": {"path": stored["path"]}})
+                raise
+
+            for field_name, stored in stored_files.items():
+                labels = (("form", current_form),)
+                metrics.inc("sodeca_upload_bytes_total", labels, stored["size"])
+                metrics.observe("sodeca_upload_size_bytes", labels, stored["size"])
+                if field_name in duplicates:
+                    metrics.inc("sodeca_duplicate_certificates_total", labels)
+
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("certificate saved", extra={"fields": {
+                        "submission_id": submission_id, "form": current_form,
+                        "file_name": form_inputs[field_name], "size": stored["size"],
+                        "duplicate_of": duplicates.get(field_name),
+                        }})
             
             # Update form number
             session["current_form_index"] += 1
@@ -818,42 +1179,262 @@ def fill_form():
             return render_template("fill_form.html", success=True, form_to_show=form_to_show)
         
         # Just show the form to be filled
-        return render_template("fill_form.html", success=False, form_to_show=form_to_show)
+        return render_template(
+            "fill_form.html", success=False, form_to_show=form_to_show, form_body=render_form_body(current_form)
+            )
     
     else:
 
         flash("Please Login/Register first")
         return redirect("/login")
     
+def is_faculty(user_id, auth_provider):
+    """
+    True if the user is one of the FACULTY_EMAILS and signed in with
+    Google, which vouches for the address. A password account proves nothing.
+    """
+    if auth_provider != "google":
+        return False
+    rows = db.execute("SELECT email, google_id FROM students WHERE user_id = ?", user_id)
+    return bool(rows) and bool(rows[0]["google_id"]) and rows[0]["email"].lower() in app.config["FACULTY_EMAILS"]
+
+def faculty_required(view):
+    """
+    Lets only faculty reach the view. Others are sent to login, or get a
+    401 or 403 JSON error on requests that aren't page loads.
+    """
+    @wraps(view)
+    def faculty_view(*args, **kwargs):
+        user_id = session.get("user_id")
+        if not user_id:
+            if request.method != "GET":
+                return jsonify({"error": "Login required"}), 401
+            flash("Please Login/Register first")
+            return redirect("/login")
+
+        if not is_faculty(user_id, session.get("auth_provider")):
+            return jsonify({"error": "Only faculty can do this"}), 403
+
+        return view(*args, **kwargs)
+    return faculty_view
+
 # Page for the faculty, to check submissions
 # Faculty can do get and post request
 @app.route("/check_submissions", methods=["GET", "POST"])
+@faculty_required
 def check_submissions():
         # On get request
         if request.method == "GET":
-            # Show all submissions of a particular batch
+            # Show one page of submissions per form, filtered by batch
 
-            # Empty list to store data from each form in db
-            all_forms_data = []
+            filters = get_submission_filters(request.args)
 
-            # Get all forms available in form's definitions
-            for form in form_name_list:
-                # Get the data for different forms
-                form_data = db.execute(f"SELECT * FROM {form}")
-                # Append it in list of differnet forms' with data
-                all_forms_data.append(form_data)
+            # Show a single form when asked, else first page of every form
+            # "all" pages through every form's submissions together
+            selected_form = request.args.get("form")
+            if selected_form and selected_form != "all" and selected_form not in FORM_DEFINITIONS:
+                return jsonify({"error": "Unknown form"}), 400
+            forms = [selected_form] if selected_form else list(form_name_list)
 
-            return render_template("check_submission.html", forms_data=all_forms_data, form_title_list=form_title, form_names=form_name_list)            
+            # Cursor and page size
+            after = request.args.get("after", type=int)
+            limit = request.args.get("limit", type=int)
+
+            # Empty list to store a page of data from each form in db
+            all_forms_data = []
+
+            for form in forms:
+                rows, next_cursor = get_submissions_page(None if form == "all" else form, filters, after, limit)
+                all_forms_data.append({
+                    "form": form,
+                    "title": "All forms" if form == "all" else FORM_DEFINITIONS[form]["title"],
+                    "rows": rows,
+                    "next_cursor": next_cursor,
+                })
+
+            if request.args.get("format") == "json":
+                return jsonify({"filters": filters, "forms": all_forms_data})
+
+            return render_template(
+                "check_submission.html", forms_data=all_forms_data, form_title_list=form_title,
+                filters=filters, filter_keys=SUBMISSION_FILTERS.keys(), limit=limit
+                )
 
         # On post request
         # Change value of approved or declined in a column
         else:
             return redirect("/sodeca_forms")
 
+# Ranked full-text search over submissions, e.g. ?q=mayukh quiz&section=B
+# Takes the same filters as check_submissions, plus form, page and limit
+@app.route("/search_submissions")
+@faculty_required
+def search_submissions_route():
+
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"error": "Nothing to search for"}), 400
+
+    filters = {SUBMISSION_FILTERS[key]: value for key, value in get_submission_filters(request.args).items()}
+    form = request.args.get("form")
+    if form:
+        if form not in FORM_DEFINITIONS:
+            return jsonify({"error": "Unknown form"}), 400
+        filters["s.form_key"] = form
+
+    limit = request.args.get("limit", app.config["SUBMISSIONS_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, app.config["SUBMISSIONS_MAX_PAGE_SIZE"]))
+    page = max(1, request.args.get("page", 1, type=int))
+
+    rows = search_submissions(db, text, filters, limit, (page - 1) * limit)
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    for row in rows:
+        row["fields"] = json.loads(row["fields"])
+
+    return jsonify({
+        "query": text, "filters": get_submission_filters(request.args), "form": form,
+        "page": page, "next_page": page + 1 if has_next else None, "results": rows,
+    })
+
+# Submission counts by form, status and batch, read only from submission_counts
+# ?group_by=form_key,status,branch picks the columns, any of them can also filter
+@app.route("/dashboard")
+@faculty_required
+def dashboard():
+
+    group_by = request.args.get("group_by", "form_key,status").split(",")
+    group_by = [column for column in group_by if column]
+    unknown = [column for column in group_by if column not in COUNT_DIMENSIONS]
+    if unknown:
+        return jsonify({"error": f"Can't group by {', '.join(unknown)}"}), 400
+
+    filters = {column: request.args[column] for column in COUNT_DIMENSIONS if request.args.get(column)}
+    counts = get_counts(db, group_by, filters)
+
+    if request.args.get("format") == "json":
+        return jsonify({"group_by": group_by, "filters": filters, "counts": counts})
+
+    return render_template(
+        "dashboard.html", counts=counts, group_by=group_by, filters=filters, dimensions=COUNT_DIMENSIONS
+        )
+
+# Prometheus scrape target
+@app.route("/metrics")
+def metrics_route():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+# Download submissions with student details as CSV or XLSX
+# Rows are streamed from the cursor, so big exports don't load in memory
+@app.route("/export_submissions")
+@faculty_required
+def export_submissions():
+
+    filters = get_submission_filters(request.args)
+
+    # One form, or every form when not given
+    selected_form = request.args.get("form")
+    if selected_form and selected_form not in FORM_DEFINITIONS:
+        return jsonify({"error": "Unknown form"}), 400
+    forms = [selected_form] if selected_form else list(form_name_list)
+
+    file_format = request.args.get("format", "csv")
+    if file_format not in ("csv", "xlsx"):
+        return jsonify({"error": "Format must be csv or xlsx"}), 400
+
+    # (form, rows) for every form, rows are read only when the writer gets there
+    sheets = []
+    for form in forms:
+        sql, params = build_submission_query(form, filters)
+        sheets.append((form, iter_rows(db, sql, params)))
+
+    file_name = f"{selected_form or 'submissions'}_{datetime.now():%Y%m%d_%H%M}.{file_format}"
+
+    if file_format == "xlsx":
+        body = iter_xlsx(sheets)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = iter_csv(sheets)
+        mimetype = "text/csv"
+
+    return Response(
+        stream_with_context(body), mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={file_name}"}
+        )
+
+# Download the certificates of the filtered submissions as one ZIP
+# The archive is written while it is sent, first bytes go out right away
+@app.route("/download_certificates")
+@faculty_required
+def download_certificates():
+
+    filters = get_submission_filters(request.args)
+
+    # One form, or every form when not given
+    selected_form = request.args.get("form")
+    if selected_form and selected_form not in FORM_DEFINITIONS:
+        return jsonify({"error": "Unknown form"}), 400
+
+    # Read in full before streaming, a cursor left open for the whole
+    # download would keep its WAL snapshot and hold back checkpoints
+    sql, params = build_certificate_query(selected_form, filters)
+    entries = certificate_entries(db.execute(sql, *params))
+
+    name_parts = [selected_form or "certificates", *filters.values()]
+    file_name = secure_filename(f"{'_'.join(map(str, name_parts))}_{datetime.now():%Y%m%d_%H%M}.zip")
+
+    return Response(
+        stream_with_context(iter_zip(entries)), mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={file_name}"}
+        )
+
+# Approve or reject submissions, many at once
+# Expects JSON {"updates": [{"submission_id", "status"}, ...]}
 @app.route("/update_sheets", methods=["POST"])
+@faculty_required
 def update_sheets():
-    flash("Entry updated", "success")
-    return redirect(request.url)
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
+    # A single {"submission_id", "status"} is also accepted
+    items = data.get("updates", [data])
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "No updates given"}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({"error": "Every update must be an object"}), 400
+
+    if len(items) > app.config["BULK_UPDATE_MAX_ROWS"]:
+        return jsonify({"error": f"At most {app.config['BULK_UPDATE_MAX_ROWS']} updates at a time"}), 400
+
+    updates = []
+    for item in items:
+        # Said on every update, a partial batch must not approve anything by default
+        status = item.get("status")
+        try:
+            submission_id = int(item.get("submission_id"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid submission_id"}), 400
+
+        if status not in DECISION_STATUSES:
+            return jsonify({"error": f"Status must be one of {', '.join(DECISION_STATUSES)}, got {status!r}"}), 400
+
+        updates.append((submission_id, status))
+
+    try:
+        changed = update_statuses(updates)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Update failed: {e}"}), 500
+
+    return jsonify({"updated": changed})
+
+# Blood donation entries, stored directly into csv
+BLOOD_DONATION_FIELDS = ["event", "from_date", "to_date", "organizer", "venue", "certificate"]
+blood_donation_journal = CSVJournal(
+    app.config["BLOOD_DONATION_CSV"], BLOOD_DONATION_FIELDS,
+    max_delay=app.config["CSV_JOURNAL_MAX_DELAY"], max_batch=app.config["CSV_JOURNAL_MAX_BATCH"],
+)
 
 @app.route("/blood_donation", methods=["GET", "POST"])
 def blood_donation():
@@ -861,29 +1442,20 @@ def blood_donation():
     if request.method == "POST":
 
         # Get the values filled by student
-        variables = ["event", "from_date", "to_date", "organizer", "venue", "certificate"]
+        variables = BLOOD_DONATION_FIELDS
         form_data = {variable: request.form.get(variable) for variable in variables}
 
         # TODO: Rename pdf 
 
-        # Store the values directly into csv or maybe sql then csv
-        csv_file_path = "blood_donation.csv"
-
         new_row = [form_data[keys] for keys in variables]
 
+        # Appended with other workers' rows in one locked, fsynced batch
+        # The header is written first when the file is new
         try:
-            with open(csv_file_path, 'a', newline='') as file:
-                writer = csv.writer(file)
-
-                # If the file did NOT exist, write the header row first
-                if not os.path.exists(csv_file_path):
-                    writer.writerow(variables) # writerow for a single row
-
-                # Write the new data row
-                writer.writerow(new_row)
+            blood_donation_journal.append(new_row)
 
         except IOError as e:
-            print(f"Error writing to CSV file: {e}")
+            log.error("blood donation row not written", extra={"fields": {"error": str(e)}})
             return render_template("blood_donation.html")
 
         return render_template("blood_donation.html")
@@ -904,9 +1476,86 @@ def blood_donation():
 
         return render_template("blood_donation.html", fields=fields_required)
 
-if __name__ == '__main__':
+@app.cli.command("import-csv")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--mapping", "mapping_path", required=True, type=click.Path(exists=True, dir_okay=False),
+              help="JSON file mapping CSV columns to the form's fields")
+@click.option("--batch-size", default=lambda: app.config["IMPORT_BATCH_SIZE"], type=int,
+              help="Rows written per transaction")
+def import_csv_command(csv_path, mapping_path, batch_size):
+    """Imports old submissions from a CSV file into a form table."""
+    try:
+        mapping = load_mapping(mapping_path, FORM_DEFINITIONS)
+    except MappingError as e:
+        raise click.ClickException(str(e))
 
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
+    form = mapping["form"]
+
+    def report(line_number, errors):
+        click.echo(f"Line {line_number}: {'; '.join(errors)}", err=True)
+
+    started = time.perf_counter()
+    with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+        try:
+            counts = import_csv(
+                db, form, FORM_DEFINITIONS[form]["fields"], FORM_VALIDATORS[form], csv_file, mapping,
+                SUBMISSION_STATUSES, batch_size=batch_size, on_reject=report,
+            )
+        except MappingError as e:
+            raise click.ClickException(str(e))
+
+    click.echo(
+        f"{counts['imported']} of {counts['rows']} rows imported into {form}, "
+        f"{counts['rejected']} rejected, in {time.perf_counter() - started:.1f}s"
+    )
+
+@app.cli.command("rebuild-counts")
+@click.option("--check", is_flag=True, help="Only report differences, don't change the table")
+def rebuild_counts_command(check):
+    """Recounts submission_counts from the submissions table."""
+    differences = rebuild_counts(db, repair=not check)
+    for group, stored, actual in differences:
+        click.echo(f"{group}: stored {stored}, actual {actual}")
+
+    if not differences:
+        click.echo("submission_counts matches the submissions")
+    elif check:
+        raise click.ClickException(f"{len(differences)} groups differ")
+    else:
+        click.echo(f"{len(differences)} groups differed, submission_counts rebuilt")
+
+def start_worker():
+    """
+    Startup work of a server process: the schema, leftover files and the
+    background threads.
+    """
+    remove_partial_uploads(UPLOAD_FOLDER)
+
+    # Create or upgrade tables, when app is loaded
+    # Skipped when FORM_DEFINITIONS didn't change since the last start
+    schema_checked = migrate(db, FORM_DEFINITIONS)
+    # Files of certificates that were deleted
+    prune_blobs(db)
+
+    if app.config["SESSION_TYPE"] == "sqlite":
+        app.session_interface.start_sweeper()
+    if upload_pool:
+        upload_pool.start()
+
+    # PRAGMA optimize on every connection, with what this worker queried
+    atexit.register(db.close)
+
+    # Time taken to load the app in this worker
+    startup_seconds = time.perf_counter() - startup_started
+    log.info("worker started", extra={"fields": {
+        "startup_ms": round(startup_seconds * 1000, 1), "schema": "checked" if schema_checked else "unchanged",
+        }})
+
+# Run as a script, multiprocessing children import this file again as
+# __mp_main__, they only need the definitions above
+if __name__ != "__mp_main__":
+    start_worker()
+
+if __name__ == '__main__':
 
     app.run(host="0.0.0.0", debug=False)
@@ -0,0 +1,159 @@
+"""
+Fingerprinted and precompressed static files.
+
+Build step, run on every deploy:
+
+    python assets.py
+
+copies every file of static/ to static/build/ under a name carrying a hash
+of its content (style.css -> style.3f2a9c01d4e7.css), writes .gz and, when
+the brotli package is installed, .br variants of the files that compress,
+and lists everything in static/build/manifest.json.
+
+StaticAssets then makes url_for('static', filename='style.css') point at
+the hashed file and serves it with the best encoding the browser accepts,
+a strong ETag and a year long immutable Cache-Control. A changed file gets
+a new name, so browsers never have to revalidate. Without a manifest
+(nothing built yet) static files are served as usual.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_FOLDER = "build"
+MANIFEST = "manifest.json"
+
+# Hashed files never change, a year is what browsers cap max-age at anyway
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Variants are only kept when they save at least this much
+MIN_COMPRESSION_RATIO = 0.9
+
+# Preferred first
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def hashed_name(filename, digest):
+    """'css/style.css' -> 'css/style.<digest>.css'"""
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{digest}{extension}"
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def build(static_folder):
+    """Writes the hashed and compressed files and their manifest, returns the manifest."""
+    build_folder = os.path.join(static_folder, BUILD_FOLDER)
+    shutil.rmtree(build_folder, ignore_errors=True)
+    os.makedirs(build_folder)
+
+    manifest = {}
+    for folder, subfolders, files in os.walk(static_folder):
+        # Don't fingerprint our own output
+        subfolders[:] = [name for name in subfolders if os.path.join(folder, name) != build_folder]
+
+        for name in sorted(files):
+            source = os.path.join(folder, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            path = hashed_name(filename, digest)
+            target = os.path.join(build_folder, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+
+            encodings = []
+            for encoding, suffix in ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                compressed = compress(data, encoding)
+                if len(compressed) <= len(data) * MIN_COMPRESSION_RATIO:
+                    with open(target + suffix, "wb") as f:
+                        f.write(compressed)
+                    encodings.append(encoding)
+
+            manifest[filename] = {"path": path, "hash": digest, "encodings": encodings}
+
+    with open(os.path.join(build_folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+
+    def __init__(self, app):
+        self.app = app
+        self.build_folder = os.path.join(app.static_folder, BUILD_FOLDER)
+
+        # Original name -> entry, and "build/<hashed name>" -> entry
+        self.manifest = {}
+        manifest_path = os.path.join(self.build_folder, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        self.hashed = {f"{BUILD_FOLDER}/{entry['path']}": entry for entry in self.manifest.values()}
+
+        if self.manifest:
+            app.url_defaults(self.url_defaults)
+            app.view_functions["static"] = self.send_static_file
+
+    def url_defaults(self, endpoint, values):
+        """url_for('static', filename='style.css') -> /static/build/style.<hash>.css"""
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = f"{BUILD_FOLDER}/{self.manifest[values['filename']]['path']}"
+
+    def send_static_file(self, filename):
+        entry = self.hashed.get(filename)
+        if entry is None:
+            return self.app.send_static_file(filename)
+
+        path = os.path.join(self.build_folder, entry["path"])
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if name in entry["encodings"] and request.accept_encodings[name]:
+                encoding, path = name, path + suffix
+                break
+
+        mimetype = mimetypes.guess_type(entry["path"])[0] or "application/octet-stream"
+        # Each encoding is a different representation, so it gets its own ETag
+        etag = f"{entry['hash']}-{encoding}" if encoding else entry["hash"]
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=31536000)
+
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static files.")
+    parser.add_argument(
+        "--static-folder", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    )
+    args = parser.parse_args()
+
+    manifest = build(args.static_folder)
+    for filename, entry in sorted(manifest.items()):
+        variants = ", ".join(entry["encodings"]) or "uncompressed"
+        print(f"{filename} -> {BUILD_FOLDER}/{entry['path']} ({variants})")
+    if brotli is None:
+        print("brotli is not installed, only gzip variants were written")
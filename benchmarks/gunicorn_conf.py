@@ -0,0 +1,21 @@
+"""
+Gunicorn settings used by benchmarks/load.py --mode gunicorn.
+
+Each worker writes its database counters to BENCHMARK_STATS_DIR when it
+exits, the harness adds them up once gunicorn has stopped.
+"""
+import json
+import os
+import sys
+
+
+def worker_exit(server, worker):
+    stats_dir = os.environ.get("BENCHMARK_STATS_DIR")
+    sodeca = sys.modules.get("app")
+    if not stats_dir or sodeca is None:
+        return
+
+    with sodeca.db.stats_lock:
+        stats = dict(sodeca.db.stats)
+    with open(os.path.join(stats_dir, f"worker-{os.getpid()}.json"), "w") as f:
+        json.dump({"pid": os.getpid(), "db": stats}, f)
@@ -0,0 +1,231 @@
+"""
+Many concurrent oversized uploads against a local gunicorn, to check that
+they are refused early and don't grow the workers' memory.
+
+    python benchmarks/large_uploads.py [--uploads 32] [--size-mb 200] [--workers 2] [--threads 8]
+
+Every upload is a fill_form submission whose certificate is --size-mb of
+zeros, generated while it is sent. Half of them announce their size with
+Content-Length, which the app refuses before reading the body. The other
+half are sent chunked, which the app cuts off once they cross the form's
+limit. One certificate just under the limit is submitted first and must
+be accepted.
+
+The workers' peak RSS (VmHWM from /proc) is read before and after the
+uploads. The exit status is 1 if any oversized upload was accepted or a
+worker's peak grew by more than --max-rss-growth-mb.
+"""
+import argparse
+import http.client
+import json
+import os
+import select
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from load import (
+    HTTPClient, Recorder, certificate, children, field_value, peak_rss_mb, percentile, select_forms, sign_up,
+    start_gunicorn, stop_gunicorn, use_scratch_files,
+)
+
+FORM = "blood_donor"
+CHUNK = 1024 * 1024
+
+
+def multipart_parts(form_definition, index, size):
+    """(boundary, head, file size, tail) of a submission whose certificate is size zero bytes."""
+    boundary = uuid.uuid4().hex
+    head = []
+    filename = None
+    for field in form_definition["fields"]:
+        if field["field_type"] == "file":
+            filename = certificate(field, index, b"")[0]
+            file_field = field["field_name"]
+            continue
+        head.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field["field_name"]}"\r\n\r\n'
+            f'{field_value(field, index)}\r\n'
+        )
+    head.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    )
+    return boundary, "".join(head).encode(), size, f"\r\n--{boundary}--\r\n".encode()
+
+
+def body_chunks(head, size, tail):
+    yield head
+    remaining = size
+    zeros = bytes(CHUNK)
+    while remaining > 0:
+        yield zeros[:min(CHUNK, remaining)]
+        remaining -= CHUNK
+    yield tail
+
+
+def upload(base_url, cookie, form_definition, index, size, chunked):
+    """
+    Sends one submission, returns {"status", "seconds", "sent"}. Stops
+    sending as soon as the server answers, sent is the bytes sent until then.
+    status is "reset" when the server closed the connection without an answer.
+    """
+    host, port = base_url.removeprefix("http://").split(":")
+    boundary, head, size, tail = multipart_parts(form_definition, index, size)
+
+    connection = http.client.HTTPConnection(host, int(port), timeout=120)
+    started = time.perf_counter()
+    sent = 0
+    try:
+        connection.putrequest("POST", "/fill_form")
+        connection.putheader("Content-Type", f"multipart/form-data; boundary={boundary}")
+        connection.putheader("Cookie", cookie)
+        if chunked:
+            connection.putheader("Transfer-Encoding", "chunked")
+        else:
+            connection.putheader("Content-Length", str(len(head) + size + len(tail)))
+        connection.endheaders()
+
+        try:
+            for chunk in body_chunks(head, size, tail):
+                connection.send(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n" if chunked else chunk)
+                sent += len(chunk)
+                # Answered already, the rest of the body isn't wanted
+                if select.select([connection.sock], [], [], 0)[0]:
+                    break
+            else:
+                if chunked:
+                    connection.send(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Refused before the whole body was sent, the answer may still be readable
+            pass
+
+        try:
+            status = connection.getresponse().status
+        except (http.client.HTTPException, ConnectionError):
+            status = "reset"
+    finally:
+        connection.close()
+    return {"status": status, "seconds": time.perf_counter() - started, "sent": sent}
+
+
+def session_cookie(client):
+    return "; ".join(f"{name}={value}" for name, value in client.session.cookies.items())
+
+
+def ready_student(base_url, index):
+    """A signed up student about to submit FORM, as a requests based client."""
+    client = HTTPClient(base_url, Recorder())
+    sign_up(client, index)
+    select_forms(client, [FORM])
+    client.request("GET", "/fill_form")
+    return client
+
+
+def worker_peaks(process):
+    return {pid: peak_rss_mb(pid) for pid in children(process.pid)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--uploads", type=int, default=32, help="oversized uploads sent at once")
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="sodeca-uploads-")
+    use_scratch_files(scratch, "pbkdf2:sha256:1000")
+    os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(scratch, "spool")
+    os.makedirs(os.environ["UPLOAD_SPOOL_DIR"])
+
+    try:
+        stats_dir = os.path.join(scratch, "worker_stats")
+        os.makedirs(stats_dir)
+        # The workers build the schema of the fresh database themselves
+        process, base_url = start_gunicorn(args.workers, args.threads, stats_dir)
+        try:
+            import app as sodeca
+
+            form_definition = sodeca.FORM_DEFINITIONS[FORM]
+            limit = sodeca.FORM_UPLOAD_LIMITS[FORM]
+
+            # Just under the limit, must go through
+            client = ready_student(base_url, 0)
+            max_size = limit - sodeca.app.config["UPLOAD_FORM_OVERHEAD"]
+            accepted = upload(base_url, session_cookie(client), form_definition, 0, max_size, chunked=False)
+
+            cookies = [session_cookie(ready_student(base_url, index)) for index in range(1, args.uploads + 1)]
+            before = worker_peaks(process)
+
+            results = [None] * args.uploads
+            def send(position):
+                results[position] = upload(
+                    base_url, cookies[position], form_definition, position + 1, args.size_mb * CHUNK,
+                    chunked=position % 2 == 1
+                )
+            threads = [threading.Thread(target=send, args=(position,)) for position in range(args.uploads)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.perf_counter() - started
+
+            after = worker_peaks(process)
+        finally:
+            stop_gunicorn(process)
+
+        spooled = len(os.listdir(os.environ["UPLOAD_SPOOL_DIR"]))
+        stored = sodeca.db.execute("SELECT COUNT(*) AS n FROM submissions")[0]["n"]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    growth = {pid: after[pid] - before[pid] for pid in before if pid in after and before[pid] and after[pid]}
+    timings = sorted(result["seconds"] for result in results)
+    statuses = {}
+    for position, result in enumerate(results):
+        key = f"{'chunked' if position % 2 else 'content-length'} {result['status']}"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    summary = {
+        "limit_bytes": limit,
+        "under_limit_status": accepted["status"],
+        "uploads": args.uploads,
+        "upload_mb": args.size_mb,
+        "statuses": statuses,
+        "submissions_stored": stored,
+        "seconds": duration,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "max_ms": timings[-1] * 1000,
+        "mean_mb_sent": sum(result["sent"] for result in results) / len(results) / CHUNK,
+        "worker_peak_rss_mb_before": list(before.values()),
+        "worker_peak_rss_mb_after": list(after.values()),
+        "worker_peak_rss_growth_mb": list(growth.values()),
+        "spool_files_left": spooled,
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    failures = []
+    if accepted["status"] != 200:
+        failures.append(f"upload under the limit got {accepted['status']}")
+    if stored != 1:
+        failures.append(f"{stored - 1} oversized uploads were stored")
+    if growth and max(growth.values()) > args.max_rss_growth_mb:
+        failures.append(f"a worker's peak RSS grew by {max(growth.values()):.1f} MB")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
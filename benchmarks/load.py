@@ -0,0 +1,570 @@
+"""
+Load test of the student submission flow against a scratch database.
+
+    python benchmarks/load.py [--mode inprocess|gunicorn] [--students 200] [--concurrency 20]
+                              [--faculty 2] [--output run.json] [--baseline previous.json]
+
+Every synthetic student goes through register -> login -> student_details
+-> sodeca_forms -> verify_student_details -> fill_form for every form,
+uploading a certificate each time, while faculty threads page through
+check_submissions with random filters until the students are done.
+Faculty sign in with Google, through the stand-in provider of
+oidc_cache.py.
+
+inprocess drives the app through Flask's test client, one per thread.
+gunicorn starts a local gunicorn on the same scratch database and drives
+it over HTTP. Both report p50/p95/p99 latency per route, throughput,
+SQLITE_BUSY retries and errors, and peak RSS (read from /proc), and save
+everything as JSON. With --baseline, routes whose p95 grew by more than
+--max-regression are listed and the exit status is 1.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "bench-password"
+# Account the faculty threads log in with
+FACULTY_EMAIL = "faculty@bench.test"
+
+# Values of the student_details form, picked per student
+DETAILS_CHOICES = {
+    "branch_option": ["CSE", "CSE(AI)", "CSE(DS)", "CSE(IOT)"],
+    "semester_option": ["3", "4", "5", "6", "7", "8"],
+    "section_option": ["A", "B", "C", "D", "E"],
+    "group_option": ["G1", "G2"],
+}
+
+# What faculty filter check_submissions by, one entry per request
+FACULTY_FILTERS = [
+    {},
+    {"status": "pending"},
+    {"section": "B"},
+    {"branch": "CSE", "semester": "5"},
+    {"batch_counselor": "Dr. Bench 1"},
+]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latencies and statuses of every request, by route."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def add(self, route, seconds, status):
+        with self.lock:
+            self.timings[route].append(seconds)
+            self.statuses[route][status] += 1
+
+    def summary(self, duration):
+        routes = {}
+        all_timings = []
+        for route in sorted(self.timings):
+            timings = sorted(self.timings[route])
+            all_timings.extend(timings)
+            statuses = self.statuses[route]
+            routes[route] = {
+                "count": len(timings),
+                "errors": sum(count for status, count in statuses.items() if status == "error" or status >= 400),
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+                "rps": len(timings) / duration,
+                **latency_summary(timings),
+            }
+        all_timings.sort()
+        return routes, latency_summary(all_timings)
+
+
+def latency_summary(sorted_timings):
+    if not sorted_timings:
+        return {}
+    return {
+        "mean_ms": sum(sorted_timings) / len(sorted_timings) * 1000,
+        "p50_ms": percentile(sorted_timings, 50) * 1000,
+        "p95_ms": percentile(sorted_timings, 95) * 1000,
+        "p99_ms": percentile(sorted_timings, 99) * 1000,
+        "max_ms": sorted_timings[-1] * 1000,
+    }
+
+
+class InProcessClient:
+    """Flask test client of one synthetic user, keeps its cookies."""
+
+    def __init__(self, app, recorder):
+        self.client = app.test_client()
+        self.recorder = recorder
+
+    def request(self, method, path, data=None, files=None):
+        if files:
+            data = dict(data or {})
+            for name, (filename, content) in files.items():
+                data[name] = (io.BytesIO(content), filename)
+
+        started = time.perf_counter()
+        try:
+            response = self.client.open(path, method=method, data=data)
+            response.get_data()
+            # Runs the app's end of request callbacks, as a server would
+            response.close()
+            status = response.status_code
+        except Exception:
+            status = "error"
+        self.recorder.add(f"{method} {path.split('?')[0]}", time.perf_counter() - started, status)
+        return status
+
+    def redirect_location(self, path):
+        """Where a GET of path redirects to."""
+        response = self.client.get(path)
+        return response.headers.get("Location")
+
+
+class HTTPClient:
+    """requests session of one synthetic user against a running server."""
+
+    def __init__(self, base_url, recorder):
+        import requests
+
+        self.session = requests.Session()
+        self.base_url = base_url
+        self.recorder = recorder
+
+    def request(self, method, path, data=None, files=None):
+        if files:
+            files = {name: (filename, content, "application/octet-stream") for name, (filename, content) in files.items()}
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.base_url + path, data=data, files=files, allow_redirects=False, timeout=60
+            )
+            status = response.status_code
+        except Exception:
+            status = "error"
+        self.recorder.add(f"{method} {path.split('?')[0]}", time.perf_counter() - started, status)
+        return status
+
+    def redirect_location(self, path):
+        """Where a GET of path redirects to."""
+        response = self.session.get(self.base_url + path, allow_redirects=False, timeout=60)
+        return response.headers.get("Location")
+
+
+def field_value(field, index):
+    """A value that passes the field's checks."""
+    rules = field.get("field_validation", {})
+    field_type = field["field_type"]
+
+    if field.get("options"):
+        options = field["options"]
+        return options[index % len(options)]["value"]
+    if field_type == "number":
+        return str(rules.get("min", 1))
+    if field_type == "date":
+        return date.today().isoformat()
+
+    value = f"Bench {field['field_name'].replace('_', ' ')} {index}"
+    value = value.ljust(rules.get("min_length", 0), "x")
+    return value[:rules.get("max_length", len(value))]
+
+
+def certificate(field, index, content):
+    """(filename, bytes) for a file field, unique per upload."""
+    accepted_types = field.get("validation", {}).get("accepted_types") or [".pdf"]
+    return f"certificate_{index}{accepted_types[0]}", f"%PDF-1.4 bench {index}\n".encode() + content
+
+
+def sign_up(client, index):
+    """Registers and logs in a student, and fills their details."""
+    email = f"student{index}@bench.test"
+    client.request("GET", "/")
+    client.request("POST", "/", {"email": email, "password": PASSWORD, "confirm_password": PASSWORD})
+    client.request("GET", "/login")
+    client.request("POST", "/login", {"email": email, "password": PASSWORD})
+
+    details = {name: values[index % len(values)] for name, values in DETAILS_CHOICES.items()}
+    details.update({
+        "university_roll_no": f"BENCH{index:06d}",
+        "student_name": f"Bench Student {index}",
+        "batch_counselor": f"Dr. Bench {index % 10}",
+    })
+    client.request("GET", "/student_details")
+    client.request("POST", "/student_details", details)
+
+
+def log_in_faculty(client, idp):
+    """Signs the faculty account of FACULTY_EMAILS in with Google, through idp."""
+    from oidc_cache import idp_get
+
+    authorize = urlparse(client.redirect_location("/auth/google"))
+    callback = urlparse(idp_get(idp, f"{authorize.path}?{authorize.query}"))
+    client.request("GET", f"{callback.path}?{callback.query}")
+
+
+def select_forms(client, forms):
+    """Picks the forms to fill and confirms the student's details."""
+    client.request("GET", "/sodeca_forms")
+    client.request("POST", "/sodeca_forms", {"selected_forms[]": forms})
+    client.request("GET", "/verify_student_details")
+    client.request("POST", "/verify_student_details", {"verified_details": "True"})
+
+
+def run_student(client, index, forms, form_definitions, submissions, content):
+    """One student's whole flow, from registering to the last form."""
+    sign_up(client, index)
+
+    for round_number in range(submissions):
+        select_forms(client, forms)
+
+        for form in forms:
+            upload_index = index * 1000 + round_number
+            data = {}
+            files = {}
+            for field in form_definitions[form]["fields"]:
+                if field["field_type"] == "file":
+                    files[field["field_name"]] = certificate(field, upload_index, content)
+                else:
+                    data[field["field_name"]] = field_value(field, upload_index)
+
+            client.request("GET", "/fill_form")
+            client.request("POST", "/fill_form", data, files)
+
+        # Every form filled, sends the student back to sodeca_forms
+        client.request("GET", "/fill_form")
+
+
+def run_faculty(client, forms, stop):
+    """check_submissions with random filters, until stop is set."""
+    choices = list(forms) + ["all"]
+    while not stop.is_set():
+        params = dict(random.choice(FACULTY_FILTERS), form=random.choice(choices))
+        query = "&".join(f"{key}={value}" for key, value in params.items())
+        client.request("GET", f"/check_submissions?{query}")
+
+
+def run_load(make_client, args, forms, form_definitions, idp):
+    """Runs every student and the faculty threads, returns the wall time in seconds."""
+    content = os.urandom(args.certificate_kb * 1024)
+    stop = threading.Event()
+
+    faculty_clients = [make_client() for _ in range(args.faculty)]
+    for client in faculty_clients:
+        log_in_faculty(client, idp)
+    faculty = [
+        threading.Thread(target=run_faculty, args=(client, forms, stop), daemon=True)
+        for client in faculty_clients
+    ]
+    started = time.perf_counter()
+    for thread in faculty:
+        thread.start()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_student, make_client(), index, forms, form_definitions, args.submissions, content)
+            for index in range(args.students)
+        ]
+        for future in futures:
+            future.result()
+
+    duration = time.perf_counter() - started
+    stop.set()
+    for thread in faculty:
+        thread.join()
+    return duration
+
+
+def process_tree(pid):
+    """pid and every process below it, read from /proc."""
+    pids = [pid]
+    for child in children(pid):
+        pids.extend(process_tree(child))
+    return pids
+
+
+def children(pid):
+    found = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                found.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return found
+
+
+def peak_rss_mb(pid):
+    """High water mark of the process's resident memory, None when unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base_url, process, timeout=60):
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            requests.get(base_url + "/login", timeout=1)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            # Refused before the bind, or a worker still migrating the database
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn didn't start in time")
+
+
+def selected_forms(args, sodeca):
+    return args.forms.split(",") if args.forms else list(sodeca.FORM_DEFINITIONS)
+
+
+def run_inprocess(args, recorder, idp):
+    import app as sodeca
+
+    forms = selected_forms(args, sodeca)
+    duration = run_load(lambda: InProcessClient(sodeca.app, recorder), args, forms, sodeca.FORM_DEFINITIONS, idp)
+
+    with sodeca.db.stats_lock:
+        db_stats = dict(sodeca.db.stats)
+    rss = {
+        "process": peak_rss_mb(os.getpid()),
+        # Password hashing processes
+        "children": [peak_rss_mb(pid) for pid in process_tree(os.getpid())[1:]],
+    }
+    return duration, db_stats, rss
+
+
+def start_gunicorn(workers, threads, stats_dir):
+    """Starts gunicorn on a free port, returns (process, base URL) once it answers."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    command = [
+        sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "benchmarks", "gunicorn_conf.py"),
+        "--workers", str(workers), "--threads", str(threads),
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "app:app",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ, BENCHMARK_STATS_DIR=stats_dir))
+    try:
+        wait_until_up(base_url, process)
+    except BaseException:
+        # SIGTERM so the arbiter takes its workers down with it
+        stop_gunicorn(process)
+        raise
+    return process, base_url
+
+
+def stop_gunicorn(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+def run_gunicorn(args, recorder, scratch, idp):
+    stats_dir = os.path.join(scratch, "worker_stats")
+    os.makedirs(stats_dir)
+    # The workers build the schema of the fresh database themselves, all at
+    # once, as on a first deploy
+    process, base_url = start_gunicorn(args.workers, args.threads, stats_dir)
+    try:
+        import app as sodeca
+
+        forms = selected_forms(args, sodeca)
+        duration = run_load(lambda: HTTPClient(base_url, recorder), args, forms, sodeca.FORM_DEFINITIONS, idp)
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode} during the run")
+
+        # Read before the workers exit
+        pids = process_tree(process.pid)
+        workers = children(process.pid)
+        rss = {
+            "master": peak_rss_mb(process.pid),
+            "workers": [peak_rss_mb(pid) for pid in workers],
+            # Password hashing processes of the workers
+            "children": [peak_rss_mb(pid) for pid in pids if pid != process.pid and pid not in workers],
+        }
+    finally:
+        stop_gunicorn(process)
+
+    db_stats = Counter()
+    for name in os.listdir(stats_dir):
+        with open(os.path.join(stats_dir, name)) as f:
+            db_stats.update(json.load(f)["db"])
+    return duration, dict(db_stats), rss
+
+
+def compare(result, baseline, max_regression):
+    """Routes whose p95 grew by more than max_regression, as (route, old ms, new ms)."""
+    regressions = []
+    for route, current in result["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous and previous.get("p95_ms") and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append((route, previous["p95_ms"], current["p95_ms"]))
+    return regressions
+
+
+def print_result(result):
+    print(f"{'route':<32} {'count':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, summary in result["routes"].items():
+        print(
+            f"{route:<32} {summary['count']:>7} {summary['errors']:>6} "
+            f"{summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f}"
+        )
+    print(
+        f"\n{result['requests']} requests in {result['duration_seconds']:.1f} s, "
+        f"{result['throughput_rps']:.1f} requests/s, {result['submissions_per_second']:.1f} submissions/s"
+    )
+    sqlite = result["sqlite"]
+    print(
+        f"SQLITE_BUSY: {sqlite.get('busy_retries', 0)} retries, {sqlite.get('busy_errors', 0)} errors, "
+        f"{sqlite.get('lock_wait_seconds', 0):.2f} s waiting"
+    )
+    print(f"Peak RSS (MB): {json.dumps(result['peak_rss_mb'])}")
+
+
+def use_scratch_files(scratch, password_hash_method=None):
+    """Points the app's settings at files in scratch, before the app is imported."""
+    os.environ.update({
+        "DATABASE_FILE": os.path.join(scratch, "bench.db"),
+        "UPLOAD_FOLDER": os.path.join(scratch, "uploads"),
+        "BLOOD_DONATION_CSV": os.path.join(scratch, "blood_donation.csv"),
+        "JINJA_BYTECODE_CACHE_DIR": os.path.join(scratch, "jinja"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark"),
+        "FACULTY_EMAILS": FACULTY_EMAIL,
+    })
+    # Certificates stay queued instead of going to Drive
+    os.environ.pop("DRIVE_UPLOADER", None)
+    if password_hash_method:
+        os.environ["PASSWORD_HASH_METHOD"] = password_hash_method
+
+
+def start_idp():
+    """Starts the stand-in Google the faculty sign in with, and points the app at it."""
+    from oidc_cache import CLIENT_ID, StubIdP
+
+    port = free_port()
+    os.environ.update({
+        "GOOGLE_DISCOVERY_URL": f"http://127.0.0.1:{port}/.well-known/openid-configuration",
+        "OAUTH_CLIENT_ID": CLIENT_ID,
+        "OAUTH_CLIENT_SECRET": "stub-secret",
+    })
+    idp = StubIdP(port, FACULTY_EMAIL)
+    idp.start()
+    return idp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["inprocess", "gunicorn"], default="inprocess")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="students submitting at once")
+    parser.add_argument("--faculty", type=int, default=2, help="threads reading check_submissions")
+    parser.add_argument("--submissions", type=int, default=1, help="times each student fills every form")
+    parser.add_argument("--forms", help="comma separated, every form by default")
+    parser.add_argument("--certificate-kb", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--password-hash-method", help="e.g. pbkdf2:sha256:1000, the app's default otherwise")
+    parser.add_argument("--output", help="JSON file, benchmarks/results/<mode>-<time>.json by default")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 growth, 0.2 = 20%%")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database and uploads")
+    args = parser.parse_args()
+
+    # The app reads its settings when imported, so they are set first
+    scratch = tempfile.mkdtemp(prefix="sodeca-bench-")
+    use_scratch_files(scratch, args.password_hash_method)
+    idp = start_idp()
+
+    try:
+        recorder = Recorder()
+        if args.mode == "inprocess":
+            duration, db_stats, rss = run_inprocess(args, recorder, idp)
+        else:
+            duration, db_stats, rss = run_gunicorn(args, recorder, scratch, idp)
+
+        import app as sodeca
+
+        submissions = sodeca.db.execute("SELECT COUNT(*) AS n FROM submissions")[0]["n"]
+    finally:
+        idp.stop()
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    routes, overall = recorder.summary(duration)
+    requests = sum(summary["count"] for summary in routes.values())
+    result = {
+        "mode": args.mode,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "keep")},
+        "duration_seconds": duration,
+        "requests": requests,
+        "errors": sum(summary["errors"] for summary in routes.values()),
+        "throughput_rps": requests / duration,
+        "submissions": submissions,
+        "submissions_per_second": submissions / duration,
+        "overall": overall,
+        "routes": routes,
+        "sqlite": db_stats,
+        "peak_rss_mb": rss,
+    }
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{args.mode}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print_result(result)
+    if args.keep:
+        print(f"Scratch files kept in {scratch}")
+    print(f"Saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        for route, previous, current in regressions:
+            print(f"REGRESSION {route}: p95 {previous:.1f} ms -> {current:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
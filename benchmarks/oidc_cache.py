@@ -0,0 +1,239 @@
+"""
+Google sign-in against a local stand-in identity provider, to check that
+the discovery document and the JWKS are cached and that id_tokens are
+still verified.
+
+    python benchmarks/oidc_cache.py [--logins 20] [--jwks-ttl 2]
+
+StubIdP serves a discovery document, a JWKS, an authorize endpoint that
+signs the user straight in, and a token endpoint returning an RS256
+id_token. The app is pointed at it through GOOGLE_DISCOVERY_URL and logs
+in through /auth/google and /auth/google/callback with Flask's test client.
+
+In order, it checks that:
+    every login works and fetches the discovery document and JWKS once
+    a login after --jwks-ttl seconds fetches the JWKS again, not the metadata
+    after a key rotation the unknown key id makes the JWKS be fetched right away
+    an id_token signed with another key under a known key id is refused
+
+The exit status is 1 if any of them fails.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http.client
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from authlib.jose import JsonWebKey, jwt
+
+from load import free_port, use_scratch_files
+
+CLIENT_ID = "stub-client"
+
+
+class StubIdP:
+    """Minimal OpenID provider on 127.0.0.1, counting the requests of each path."""
+
+    def __init__(self, port, email="stub.user@example.com"):
+        self.issuer = f"http://127.0.0.1:{port}"
+        # Who every sign-in is for
+        self.email = email
+        self.hits = {}
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.key = self.new_key()
+        # Signs id_tokens instead of self.key when set, kid stays the one of self.key
+        self.forged_key = None
+
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                idp.handle(self, "GET")
+
+            def do_POST(self):
+                idp.handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+    def new_key(self):
+        return JsonWebKey.generate_key("RSA", 2048, is_private=True, options={"kid": secrets.token_hex(4)})
+
+    def rotate_key(self):
+        self.key = self.new_key()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        with self.lock:
+            self.hits[url.path] = self.hits.get(url.path, 0) + 1
+
+        if url.path == "/.well-known/openid-configuration":
+            self.send_json(request, {
+                "issuer": self.issuer,
+                "authorization_endpoint": f"{self.issuer}/authorize",
+                "token_endpoint": f"{self.issuer}/token",
+                "jwks_uri": f"{self.issuer}/jwks",
+                "id_token_signing_alg_values_supported": ["RS256"],
+            })
+        elif url.path == "/jwks":
+            self.send_json(request, {"keys": [self.key.as_dict(is_private=False)]})
+        elif url.path == "/authorize":
+            # Signs the user in right away, the code remembers the nonce
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            code = secrets.token_urlsafe(16)
+            with self.lock:
+                self.codes[code] = query.get("nonce")
+            location = f"{query['redirect_uri']}?{urlencode({'code': code, 'state': query['state']})}"
+            request.send_response(302)
+            request.send_header("Location", location)
+            request.end_headers()
+        elif url.path == "/token" and method == "POST":
+            length = int(request.headers.get("Content-Length", 0))
+            form = {key: values[0] for key, values in parse_qs(request.rfile.read(length).decode()).items()}
+            with self.lock:
+                nonce = self.codes.pop(form.get("code"), None)
+            self.send_json(request, {
+                "access_token": secrets.token_urlsafe(16), "token_type": "Bearer", "expires_in": 3600,
+                "id_token": self.id_token(nonce),
+            })
+        else:
+            request.send_response(404)
+            request.end_headers()
+
+    def id_token(self, nonce):
+        now = int(time.time())
+        claims = {
+            "iss": self.issuer, "aud": CLIENT_ID, "sub": f"stub-{self.email}", "email": self.email,
+            "email_verified": True,
+            "given_name": "Stub", "family_name": "User", "iat": now, "exp": now + 600,
+        }
+        if nonce:
+            claims["nonce"] = nonce
+        header = {"alg": "RS256", "kid": self.key.as_dict()["kid"]}
+        return jwt.encode(header, claims, self.forged_key or self.key).decode()
+
+    def send_json(self, request, document):
+        body = json.dumps(document).encode()
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def google_login(sodeca, idp):
+    """One sign-in through the app, returns the user_id it logged in, None if refused."""
+    client = sodeca.app.test_client()
+    response = client.get("/auth/google")
+    authorize = urlparse(response.headers["Location"])
+
+    # The browser's trip to the provider and back
+    answer = idp_get(idp, f"{authorize.path}?{authorize.query}")
+    callback = urlparse(answer)
+    client.get(f"{callback.path}?{callback.query}")
+
+    with client.session_transaction() as session:
+        return session.get("user_id")
+
+
+def idp_get(idp, path):
+    """Location the provider redirects a GET of path to."""
+    host = urlparse(idp.issuer)
+    connection = http.client.HTTPConnection(host.hostname, host.port, timeout=10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.getheader("Location")
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--jwks-ttl", type=float, default=2, help="seconds, shortened so the test is quick")
+    args = parser.parse_args()
+
+    port = free_port()
+    scratch = tempfile.mkdtemp(prefix="sodeca-oidc-")
+    use_scratch_files(scratch)
+    os.environ.update({
+        "GOOGLE_DISCOVERY_URL": f"http://127.0.0.1:{port}/.well-known/openid-configuration",
+        "OAUTH_CLIENT_ID": CLIENT_ID,
+        "OAUTH_CLIENT_SECRET": "stub-secret",
+    })
+
+    idp = StubIdP(port)
+    idp.start()
+    checks = []
+    try:
+        import app as sodeca
+
+        sodeca.app.config.update(
+            OIDC_METADATA_TTL=3600, OIDC_JWKS_TTL=args.jwks_ttl, OIDC_JWKS_MIN_REFRESH=args.jwks_ttl / 2
+        )
+
+        started = time.perf_counter()
+        users = [google_login(sodeca, idp) for _ in range(args.logins)]
+        seconds = time.perf_counter() - started
+        checks.append((
+            f"{args.logins} logins, metadata and JWKS fetched once",
+            all(users) and idp.hits.get("/.well-known/openid-configuration") == 1 and idp.hits.get("/jwks") == 1
+        ))
+
+        time.sleep(args.jwks_ttl + 0.1)
+        user = google_login(sodeca, idp)
+        checks.append((
+            "login after the JWKS TTL fetches the JWKS again",
+            user and idp.hits.get("/jwks") == 2 and idp.hits.get("/.well-known/openid-configuration") == 1
+        ))
+
+        # Past jwks_min_refresh, so an unknown key id may fetch again
+        time.sleep(args.jwks_ttl / 2 + 0.1)
+        idp.rotate_key()
+        user = google_login(sodeca, idp)
+        checks.append(("login after a key rotation fetches the new key", user and idp.hits.get("/jwks") == 3))
+
+        idp.forged_key = idp.new_key()
+        user = google_login(sodeca, idp)
+        checks.append(("id_token signed with another key is refused", user is None))
+
+        stats = dict(sodeca.get_google().stats)
+    finally:
+        idp.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(json.dumps({
+        "logins": args.logins,
+        "ms_per_login": seconds / args.logins * 1000,
+        "idp_requests": idp.hits,
+        "client_stats": stats,
+    }, indent=2))
+
+    failed = False
+    for description, passed in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {description}")
+        failed = failed or not passed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
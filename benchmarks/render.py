@@ -0,0 +1,84 @@
+"""
+Render-time benchmark of the form pages, with and without the template caches.
+
+    python benchmarks/render.py [--iterations 2000]
+
+Measures, in the same process:
+    compile   loading every template into a new Jinja environment, as a new
+              worker does, without and with the bytecode cache
+    fill_form a GET of every form page, fields rendered each time and taken
+              from the fragment cache
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import FileSystemBytecodeCache
+
+import app as sodeca
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return (
+        f"mean {statistics.mean(timings) * 1e6:8.1f} us   "
+        f"p50 {timings[len(timings) // 2] * 1e6:8.1f} us   "
+        f"p95 {timings[int(len(timings) * 0.95)] * 1e6:8.1f} us"
+    )
+
+
+def time_compile(bytecode_cache, iterations):
+    """Seconds to load every template into a fresh environment."""
+    timings = []
+    for _ in range(iterations):
+        env = sodeca.app.create_jinja_environment()
+        env.bytecode_cache = bytecode_cache
+        started = time.perf_counter()
+        for name in env.list_templates():
+            env.get_template(name)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def time_forms(iterations):
+    """Seconds to render the fill_form page of every form."""
+    timings = []
+    with sodeca.app.test_request_context("/fill_form"):
+        for _ in range(iterations):
+            for form, definition in sodeca.FORM_DEFINITIONS.items():
+                started = time.perf_counter()
+                sodeca.render_template(
+                    "fill_form.html", success=False, form_to_show=definition,
+                    form_body=sodeca.render_form_body(form)
+                )
+                timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    compile_iterations = max(args.iterations // 20, 10)
+    with tempfile.TemporaryDirectory() as directory:
+        bytecode_cache = FileSystemBytecodeCache(directory)
+        # Fill the cache once, like the first worker to start
+        time_compile(bytecode_cache, 1)
+        print(f"compile   no cache        {summary(time_compile(None, compile_iterations))}")
+        print(f"compile   bytecode cache  {summary(time_compile(bytecode_cache, compile_iterations))}")
+
+    sodeca.fragments.enabled = False
+    print(f"fill_form no cache        {summary(time_forms(args.iterations))}")
+    sodeca.fragments.enabled = True
+    sodeca.fragments.clear()
+    print(f"fill_form fragment cache  {summary(time_forms(args.iterations))}")
+
+
+if __name__ == "__main__":
+    main()
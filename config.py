@@ -6,13 +6,72 @@ load_dotenv()
 
 class Config:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER')
+    UPLOAD_CHUNK_SIZE = 64 * 1024     # Bytes written to disk at a time
+    # Request body limits, per form from the max_size of its file fields
+    UPLOAD_MAX_SIZE = '5MB'           # File fields without a max_size
+    UPLOAD_FORM_OVERHEAD = 64 * 1024  # Other fields and multipart headers
+    UPLOAD_SPOOL_THRESHOLD = 64 * 1024   # Bytes of a file kept in memory before spooling to disk
+    UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR')   # None for the system temp folder
     ALLOWED_EXTENSIONS = {'pdf'}
     DATABASE_FILE = os.getenv('DATABASE_FILE')
+
+    # SQLite concurrency, WAL journal is always used
+    SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))   # ms to wait for a lock
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')     # Safe with WAL, fewer fsyncs
+    SQLITE_BUSY_RETRIES = 5
+    SQLITE_BUSY_BACKOFF = 0.05        # Seconds, doubled on every retry
+    SQLITE_OPTIMIZE_INTERVAL = 3600   # Seconds between PRAGMA optimize on each connection
+
+    # Student details cached across requests of the same worker, 0 to disable
+    # Other workers may show old details for up to this many seconds after an update
+    STUDENT_DETAILS_CACHE_TTL = int(os.getenv('STUDENT_DETAILS_CACHE_TTL', 30))
+    STUDENT_DETAILS_CACHE_SIZE = 2048
+
+    # Compiled templates kept on disk, so new workers skip compiling them
+    JINJA_BYTECODE_CACHE = True
+    JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR')   # None for a private folder in the temp dir
+    FRAGMENT_CACHE = True             # Form fields rendered once per form definition
+
+    # Blood donation entries, appended by every worker in fsynced batches
+    BLOOD_DONATION_CSV = os.getenv('BLOOD_DONATION_CSV', 'blood_donation.csv')
+    CSV_JOURNAL_MAX_DELAY = 0.01      # Seconds a row waits for others to share its fsync
+    CSV_JOURNAL_MAX_BATCH = 256       # Rows written at a time
+
+    IMPORT_BATCH_SIZE = 5000          # Rows per transaction of "flask import-csv"
+
+    # Accounts allowed into the faculty pages, comma separated emails
+    FACULTY_EMAILS = {email.strip().lower() for email in os.getenv('FACULTY_EMAILS', '').split(',') if email.strip()}
+
+    # Faculty submissions view (rows per page)
+    SUBMISSIONS_PAGE_SIZE = 50
+    SUBMISSIONS_MAX_PAGE_SIZE = 500
+    BULK_UPDATE_MAX_ROWS = 1000       # Status changes in one request
     SECRET_KEY = os.getenv('SECRET_KEY')
 
+    # JSON log lines on stderr, DEBUG adds one line per saved certificate
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+    # Prometheus metrics at /metrics
+    # With a folder, workers share their numbers through it, empty it on deploy
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5        # Seconds between writes of a worker's file
+
+    # Password hashing, older hashes are upgraded to this method on login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))   # Processes, 0 to hash inline
+    PASSWORD_HASH_MAX_PENDING = 16    # Hashes waiting before logins get a 503
+    PASSWORD_HASH_TIMEOUT = 10        # Seconds
+
     # Session configuration
     SESSION_PERMANENT = False
-    SESSION_TYPE = "filesystem"
+    SESSION_TYPE = os.getenv('SESSION_TYPE', 'sqlite')   # "sqlite" or any Flask-Session type
+    # In-process cache of sessions, seconds, 0 to disable
+    # Only safe when every request of a user reaches the same worker
+    SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', 0))
+    SESSION_CACHE_SIZE = 1024
+    SESSION_REFRESH_AFTER = 300       # Unchanged sessions get a new expiry at most this often
+    SESSION_SWEEP_INTERVAL = 300      # Seconds between deletes of expired sessions
+    SESSION_SWEEP_BATCH = 1000
 
     # Session security settings
     SESSION_COOKIE_SECURE = False     # Only send cookies over HTTPS(false for development only!)
@@ -23,6 +82,20 @@ class Config:
     SESSION_COOKIE_MAX_AGE = 3600  # Session expires in 1 hour
     PERMANENT_SESSION_LIFETIME = 3600  # Same as above
     
+    # Google Drive uploads, "drive", "local" or unset to keep jobs queued
+    DRIVE_UPLOADER = os.getenv('DRIVE_UPLOADER')
+    DRIVE_FOLDER_ID = os.getenv('DRIVE_FOLDER_ID')
+    DRIVE_LOCAL_FOLDER = os.getenv('DRIVE_LOCAL_FOLDER', 'drive_uploads')
+    GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv('GOOGLE_SERVICE_ACCOUNT_FILE')
+    DRIVE_UPLOAD_WORKERS = int(os.getenv('DRIVE_UPLOAD_WORKERS', 2))
+    DRIVE_UPLOAD_MAX_ATTEMPTS = 5
+    DRIVE_CHUNK_SIZE = 1024 * 1024    # Resumable upload chunk, multiple of 256KB
+
     # OAuth credentials
     GOOGLE_CLIENT_ID = os.getenv('OAUTH_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.getenv('OAUTH_CLIENT_SECRET')
+    # Point at a local identity provider to test sign-in without Google
+    GOOGLE_DISCOVERY_URL = os.getenv('GOOGLE_DISCOVERY_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+    OIDC_METADATA_TTL = 24 * 60 * 60    # Discovery document, seconds
+    OIDC_JWKS_TTL = 60 * 60    # Signing keys, shortened by the provider's Cache-Control max-age
+    OIDC_JWKS_MIN_REFRESH = 60    # Seconds between refetches for unknown key ids
@@ -0,0 +1,237 @@
+"""
+SQLite access layer shared by every route.
+
+Database.execute() works like cs50's SQL.execute(): SELECT returns a list of
+dicts, INSERT the new row's id, UPDATE and DELETE the number of rows changed.
+
+Each thread of each worker process keeps its own connection, opened on first
+use with WAL journaling, a busy timeout and the configured synchronous level,
+so readers don't block the writer and writers wait for the lock instead of
+failing. Statements that still hit SQLITE_BUSY outside a transaction are
+retried with bounded exponential backoff. The time spent waiting on locks,
+in SQLite's busy handler and between retries, is counted in Database.stats.
+start_tally() and stop_tally() count the execute() calls of one thread and
+their time, for per-request metrics.
+
+Every optimize_interval seconds, and in close(), which the app calls at
+exit, a connection runs PRAGMA optimize. SQLite then runs ANALYZE on the
+tables that connection queried whose statistics are missing or stale, so
+the planner keeps picking the indexes that fit the data.
+"""
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import time
+
+
+# Statements that take the write lock, so can wait on another connection's
+LOCKING_COMMANDS = {"BEGIN", "INSERT", "UPDATE", "DELETE", "REPLACE"}
+
+
+def is_busy_error(error):
+    """True if the error means another connection holds the lock."""
+    message = str(error).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+class Database:
+
+    def __init__(self, path, busy_timeout=5000, synchronous="NORMAL", journal_mode="WAL",
+                 busy_retries=5, busy_backoff=0.05, optimize_interval=3600):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.journal_mode = journal_mode
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self.optimize_interval = optimize_interval
+
+        self.local = threading.local()
+        # (pid, connection) of every thread's connection, for close()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"statements": 0, "busy_retries": 0, "busy_errors": 0, "lock_wait_seconds": 0.0}
+
+    def connect(self):
+        """Opens a new connection with the configured pragmas."""
+        # Autocommit, transactions are only opened by an explicit BEGIN
+        connection = sqlite3.connect(
+            self.path, timeout=self.busy_timeout / 1000, isolation_level=None, check_same_thread=False
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    def connection(self):
+        """Connection of the current thread, reopened after a fork."""
+        pid = os.getpid()
+        if getattr(self.local, "pid", None) != pid:
+            # A connection inherited from the parent process must not be used
+            self.local.connection = self.connect()
+            self.local.pid = pid
+            self.local.optimized_at = time.monotonic()
+            with self.connections_lock:
+                self.connections.append((pid, self.local.connection))
+        return self.local.connection
+
+    def optimize(self, connection):
+        """PRAGMA optimize, for the tables this connection queried."""
+        try:
+            connection.execute("PRAGMA optimize")
+        except sqlite3.OperationalError as e:
+            # Locked by a writer, the next time will do
+            if not is_busy_error(e):
+                raise
+        self.local.optimized_at = time.monotonic()
+
+    def maybe_optimize(self, connection):
+        """Optimizes when optimize_interval has passed, never inside a transaction."""
+        if (self.optimize_interval and not connection.in_transaction
+                and time.monotonic() - self.local.optimized_at >= self.optimize_interval):
+            self.optimize(connection)
+
+    def close(self):
+        """
+        Optimizes and closes every connection this process opened, once no
+        thread uses them any more, e.g. at exit.
+        """
+        pid = os.getpid()
+        with self.connections_lock:
+            connections = [connection for owner, connection in self.connections if owner == pid]
+            self.connections = []
+        for connection in connections:
+            try:
+                self.optimize(connection)
+            finally:
+                connection.close()
+        self.local.pid = None
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def run(self, connection, method, sql, params):
+        """
+        Runs connection.execute or executemany, retrying on SQLITE_BUSY.
+        Inside a transaction the error is raised right away, the caller
+        has to roll back and start again.
+        """
+        # Waits for another writer, unless the transaction already holds the lock
+        locking = (
+            method == "execute" and not connection.in_transaction
+            and sql.lstrip().split(None, 1)[0].upper() in LOCKING_COMMANDS
+        )
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                if locking:
+                    cursor = self.run_locking(connection, sql, params)
+                else:
+                    cursor = getattr(connection, method)(sql, params)
+                break
+            except sqlite3.OperationalError as e:
+                if is_busy_error(e) and not locking:
+                    # The whole busy timeout went by in SQLite's busy handler
+                    self.count("lock_wait_seconds", time.perf_counter() - started)
+                if not is_busy_error(e) or connection.in_transaction or attempt >= self.busy_retries:
+                    if is_busy_error(e):
+                        self.count("busy_errors")
+                    raise
+                self.count("busy_retries")
+                delay = self.busy_backoff * 2 ** attempt
+                time.sleep(delay)
+                self.count("lock_wait_seconds", delay)
+                attempt += 1
+
+        self.count("statements")
+        return cursor
+
+    def run_locking(self, connection, sql, params):
+        """
+        Runs a statement that takes the write lock. The first try is made
+        with SQLite's busy handler off, so an uncontended statement isn't
+        timed. Only when another writer holds the lock is it run again with
+        the busy timeout, and that whole call counts as lock wait.
+        """
+        connection.execute("PRAGMA busy_timeout = 0")
+        try:
+            return connection.execute(sql, params)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+        finally:
+            connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+
+        started = time.perf_counter()
+        try:
+            return connection.execute(sql, params)
+        finally:
+            self.count("lock_wait_seconds", time.perf_counter() - started)
+
+    def start_tally(self):
+        """Starts counting this thread's execute() and executemany() calls and their time."""
+        self.local.tally = [0, 0.0]
+
+    def stop_tally(self):
+        """Returns (calls, seconds) since start_tally() and stops counting."""
+        tally = getattr(self.local, "tally", None) or [0, 0.0]
+        self.local.tally = None
+        return tally[0], tally[1]
+
+    def add_to_tally(self, started):
+        tally = getattr(self.local, "tally", None)
+        if tally is not None:
+            tally[0] += 1
+            tally[1] += time.perf_counter() - started
+
+    def execute(self, sql, *args):
+        """Runs one statement, the return value depends on the statement like in cs50."""
+        started = time.perf_counter()
+        connection = self.connection()
+        try:
+            cursor = self.run(connection, "execute", sql, args)
+
+            # SELECT, PRAGMA and RETURNING give back rows
+            if cursor.description is not None:
+                return [dict(row) for row in cursor.fetchall()]
+
+            command = sql.lstrip().split(None, 1)[0].upper()
+            if command in ("INSERT", "REPLACE"):
+                return cursor.lastrowid if cursor.rowcount == 1 else None
+            if command in ("UPDATE", "DELETE"):
+                return cursor.rowcount
+            return True
+        finally:
+            self.add_to_tally(started)
+            self.maybe_optimize(connection)
+
+    def executemany(self, sql, seq_of_params):
+        """Runs one statement for every set of params, returns the rows changed."""
+        started = time.perf_counter()
+        connection = self.connection()
+        try:
+            return self.run(connection, "executemany", sql, seq_of_params).rowcount
+        finally:
+            self.add_to_tally(started)
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        """
+        Runs the block in one transaction on the thread's connection.
+        IMMEDIATE takes the write lock at the start, so the block never
+        fails halfway on a lock upgrade.
+        """
+        connection = self.connection()
+        self.run(connection, "execute", f"BEGIN {mode}", ())
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
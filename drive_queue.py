@@ -0,0 +1,224 @@
+"""
+Background queue for uploading certificates to Google Drive.
+
+fill_form() only adds a row to the "upload_jobs" table, a pool of worker
+threads picks the jobs up and uploads the files, so a request never waits
+on Drive. Failed uploads are retried with exponential backoff.
+
+Uploaders are plain objects with an upload(path, file_name) method that
+returns the id of the uploaded file. DriveUploader talks to Google Drive,
+LocalUploader copies files into a folder and can stand in for Drive when
+testing.
+"""
+from datetime import datetime, timedelta, timezone
+import logging
+import mimetypes
+import os
+import random
+import shutil
+import sqlite3
+import threading
+
+log = logging.getLogger("sodeca.drive_queue")
+
+# Upload states, also shown to faculty for every certificate
+QUEUED = "queued"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+
+def utc_now():
+    """Current UTC time in the format of SQLite's CURRENT_TIMESTAMP."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue(db, certificate_id, path, file_name):
+    """Adds an upload job for a stored certificate."""
+    db.execute(
+        "INSERT INTO upload_jobs (certificate_id, path, file_name) VALUES (?, ?, ?)",
+        certificate_id, path, file_name
+    )
+    db.execute(
+        "UPDATE certificates SET drive_status = ?, drive_file_id = NULL WHERE certificate_id = ?",
+        QUEUED, certificate_id
+    )
+
+
+def reuse_upload(db, certificate_id, drive_file_id):
+    """Points a certificate at a file already on Drive, no job is queued."""
+    db.execute(
+        "UPDATE certificates SET drive_status = ?, drive_file_id = ? WHERE certificate_id = ?",
+        DONE, drive_file_id, certificate_id
+    )
+
+
+class DriveUploader:
+    """Resumable, chunked uploads to a Google Drive folder."""
+
+    def __init__(self, service_account_file, folder_id, chunk_size=1024 * 1024):
+        self.service_account_file = service_account_file
+        self.folder_id = folder_id
+        self.chunk_size = chunk_size
+        # httplib2 connections can't be shared between threads
+        self.local = threading.local()
+
+    def service(self):
+        """Drive client of the current thread, built on first use."""
+        if not hasattr(self.local, "service"):
+            from google.oauth2.service_account import Credentials
+            from googleapiclient.discovery import build
+
+            credentials = Credentials.from_service_account_file(
+                self.service_account_file, scopes=["https://www.googleapis.com/auth/drive.file"]
+            )
+            self.local.service = build("drive", "v3", credentials=credentials, cache_discovery=False)
+        return self.local.service
+
+    def upload(self, path, file_name):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        mimetype = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        with open(path, "rb") as file:
+            media = MediaIoBaseUpload(file, mimetype=mimetype, chunksize=self.chunk_size, resumable=True)
+            request = self.service().files().create(
+                body={"name": file_name, "parents": [self.folder_id]},
+                media_body=media, fields="id", supportsAllDrives=True
+            )
+
+            # Send one chunk at a time until Drive returns the created file
+            response = None
+            while response is None:
+                status, response = request.next_chunk(num_retries=3)
+
+        return response["id"]
+
+
+class LocalUploader:
+    """Copies files into a local folder instead of Drive."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def upload(self, path, file_name):
+        destination = os.path.join(self.folder, file_name)
+        shutil.copyfile(path, destination)
+        return destination
+
+
+class UploadWorkerPool:
+    """
+    Threads that drain the upload_jobs table.
+    Jobs are claimed with a single UPDATE, so several pools (one per
+    gunicorn worker) can share the same queue.
+    """
+
+    def __init__(self, db, uploader, workers=2, max_attempts=5, base_delay=2.0,
+                 poll_interval=1.0, stale_after=600):
+        self.db = db
+        self.uploader = uploader
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """Requeues jobs left uploading by a crashed worker, then starts the threads."""
+        connection = self.db.connect()
+        try:
+            stale_before = (datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)).strftime("%Y-%m-%d %H:%M:%S")
+            connection.execute(
+                "UPDATE upload_jobs SET status = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, UPLOADING, stale_before)
+            )
+        finally:
+            connection.close()
+
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f"drive-upload-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def claim(self, connection):
+        """Marks the oldest due job as uploading and returns it, None if there is none."""
+        return connection.execute(
+            """
+            UPDATE upload_jobs SET status = ?, attempts = attempts + 1, updated_at = ?
+            WHERE job_id = (
+                SELECT job_id FROM upload_jobs
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY job_id LIMIT 1
+            )
+            RETURNING job_id, certificate_id, path, file_name, attempts
+            """,
+            (UPLOADING, utc_now(), QUEUED, utc_now())
+        ).fetchone()
+
+    def run_once(self, connection):
+        """Uploads one job. Returns False when the queue had nothing due."""
+        job = self.claim(connection)
+        if job is None:
+            return False
+
+        try:
+            file_id = self.uploader.upload(job["path"], job["file_name"])
+        except Exception as e:
+            if job["attempts"] >= self.max_attempts:
+                status, next_attempt = FAILED, utc_now()
+            else:
+                # Exponential backoff with jitter, 2s, 4s, 8s...
+                delay = self.base_delay * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+                status = QUEUED
+                next_attempt = (datetime.now(timezone.utc) + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+
+            connection.execute(
+                "UPDATE upload_jobs SET status = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE job_id = ?",
+                (status, next_attempt, str(e), utc_now(), job["job_id"])
+            )
+            connection.execute(
+                "UPDATE certificates SET drive_status = ? WHERE certificate_id = ?",
+                (status, job["certificate_id"])
+            )
+            return True
+
+        connection.execute(
+            "UPDATE upload_jobs SET status = ?, drive_file_id = ?, last_error = NULL, updated_at = ? WHERE job_id = ?",
+            (DONE, file_id, utc_now(), job["job_id"])
+        )
+        connection.execute(
+            "UPDATE certificates SET drive_status = ?, drive_file_id = ? WHERE certificate_id = ?",
+            (DONE, file_id, job["certificate_id"])
+        )
+        return True
+
+    def run(self):
+        connection = self.db.connect()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    if not self.run_once(connection):
+                        self.stop_event.wait(self.poll_interval)
+                except sqlite3.OperationalError as e:
+                    # Database busy, try again on the next poll
+                    log.warning("upload worker retrying", extra={"fields": {"error": str(e)}})
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def drain(self):
+        """Runs jobs in the calling thread until none are due, for tests and scripts."""
+        connection = self.db.connect()
+        try:
+            while self.run_once(connection):
+                pass
+        finally:
+            connection.close()
@@ -0,0 +1,222 @@
+"""
+Streaming CSV, XLSX and ZIP writers for exporting submissions.
+
+Every writer is a generator, it takes rows one at a time from a cursor and
+yields bytes as soon as they are ready, so memory stays flat no matter how
+many rows are exported.
+"""
+from xml.sax.saxutils import escape
+import csv
+import io
+import zipfile
+
+# Flush to the client after this many rows
+ROWS_PER_CHUNK = 500
+
+# Bytes of a certificate read and sent at a time
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+def iter_rows(db, sql, params):
+    """
+    Yields the column names and then every row of a query, one at a time,
+    straight from the sqlite cursor.
+    A connection of its own keeps the read snapshot open only for the export.
+    """
+    connection = db.connect()
+    try:
+        cursor = connection.execute(sql, params)
+        yield [col[0] for col in cursor.description]
+        for row in cursor:
+            yield row
+    finally:
+        connection.close()
+
+
+class StreamBuffer:
+    """
+    Write-only file object that keeps what was written until it is popped.
+    zipfile writes into it without seeking, as it has no tell() or seek().
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Returns everything written since the last pop."""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_csv(sheets):
+    """
+    Yields a CSV file, sheets is a list of (name, rows) where rows is an
+    iterator whose first item is the header.
+    With more than one sheet there is a single header, a leading "form"
+    column and then every column of any sheet, in order of appearance.
+    Each row is blank in the columns its sheet doesn't have.
+    """
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    if len(sheets) == 1:
+        name, rows = sheets[0]
+        # Header and rows as they come
+        sheets = [(None, rows)]
+    else:
+        # Every header is read first, to write the union of them once
+        headers = [next(rows) for name, rows in sheets]
+        columns = list(dict.fromkeys(column for header in headers for column in header))
+        writer.writerow(["form", *columns])
+        positions = [[columns.index(column) for column in header] for header in headers]
+
+    for number, (name, rows) in enumerate(sheets):
+        for count, row in enumerate(rows):
+            if name is None:
+                writer.writerow(row)
+            else:
+                values = [""] * len(columns)
+                for position, value in zip(positions[number], row):
+                    values[position] = value
+                writer.writerow([name, *values])
+
+            if count % ROWS_PER_CHUNK == 0:
+                yield line.getvalue().encode("utf-8")
+                line.seek(0)
+                line.truncate()
+
+    yield line.getvalue().encode("utf-8")
+
+
+def column_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def xlsx_row(row_number, values):
+    """One <row> of a worksheet, every value as an inline string."""
+    cells = []
+    for col, value in enumerate(values):
+        if value is None:
+            continue
+        ref = f"{column_letter(col)}{row_number}"
+        cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+
+def iter_xlsx(sheets):
+    """
+    Yields an XLSX workbook with one worksheet per (name, rows) in sheets.
+    The zip is written to a StreamBuffer, so each chunk is sent while the
+    next rows are still being read.
+    """
+    buffer = StreamBuffer()
+    workbook = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED)
+
+    sheet_names = [name[:31] for name, rows in sheets]
+
+    content_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheets) + 1)
+    )
+    workbook.writestr("[Content_Types].xml", (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        f'{content_types}</Types>'
+    ))
+    workbook.writestr("_rels/.rels", (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    ))
+    workbook.writestr("xl/workbook.xml", (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+        + "".join(
+            f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+            for i, name in enumerate(sheet_names, start=1)
+        )
+        + '</sheets></workbook>'
+    ))
+    workbook.writestr("xl/_rels/workbook.xml.rels", (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + "".join(
+            f'<Relationship Id="rId{i}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, len(sheets) + 1)
+        )
+        + '</Relationships>'
+    ))
+    yield buffer.pop()
+
+    for i, (name, rows) in enumerate(sheets, start=1):
+        with workbook.open(f"xl/worksheets/sheet{i}.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for count, row in enumerate(rows, start=1):
+                sheet.write(xlsx_row(count, row).encode("utf-8"))
+                if count % ROWS_PER_CHUNK == 0:
+                    yield buffer.pop()
+            sheet.write(b"</sheetData></worksheet>")
+        yield buffer.pop()
+
+    workbook.close()
+    yield buffer.pop()
+
+
+def iter_zip(files, chunk_size=FILE_CHUNK_SIZE):
+    """
+    Yields a ZIP archive of files, an iterator of (entry name, path).
+    Files are stored as they are, certificates are mostly PDFs and images
+    that don't compress, and copied in chunks, so each chunk is sent as
+    soon as it is read. Files missing on disk are listed in MISSING.txt.
+    """
+    buffer = StreamBuffer()
+    archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED)
+    missing = []
+
+    for name, path in files:
+        try:
+            source = open(path, "rb")
+        except FileNotFoundError:
+            missing.append(name)
+            continue
+
+        with source, archive.open(name, "w", force_zip64=True) as entry:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                entry.write(chunk)
+                yield buffer.pop()
+        yield buffer.pop()
+
+    if missing:
+        archive.writestr("MISSING.txt", "".join(f"{name}\n" for name in missing))
+    archive.close()
+    yield buffer.pop()
@@ -0,0 +1,52 @@
+"""
+Rendered template fragments, reused across requests.
+
+Parts of a page built only from data fixed at startup, like the fields of
+a form, are rendered once per worker. Each fragment is keyed by its
+template and a hash of the data it was rendered from, so a changed form
+definition is rendered again instead of showing the old markup.
+
+Fragments must not use request, session, g or flashed messages, those
+stay in the page around them.
+"""
+import hashlib
+import json
+import threading
+
+from flask import render_template
+from markupsafe import Markup
+
+
+def definition_hash(definition):
+    """Hash of a form definition, stable across workers and restarts."""
+    return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class FragmentCache:
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # (template, key) -> Markup
+        self.fragments = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def render(self, template, key, **context):
+        """Renders template with context, or returns what it rendered for key before."""
+        if not self.enabled:
+            return Markup(render_template(template, **context))
+
+        fragment = self.fragments.get((template, key))
+        with self.lock:
+            self.stats["hits" if fragment is not None else "misses"] += 1
+        if fragment is not None:
+            return fragment
+
+        fragment = Markup(render_template(template, **context))
+        with self.lock:
+            self.fragments[(template, key)] = fragment
+        return fragment
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
@@ -0,0 +1,117 @@
+"""
+Password hashing on a bounded pool of worker processes.
+
+Hashing is deliberately slow, so running it on the request thread lets a
+burst of logins hold every worker. PasswordHasher sends the work to a small
+process pool and refuses new work with PasswordHasherBusy once max_pending
+hashes are already waiting, so the route can answer 503 right away instead
+of queueing forever.
+
+The pool is created on first use in each process, after gunicorn has forked
+its workers. Its processes come from a forkserver, a single-threaded
+process started for the pool, because forking a threaded gunicorn worker
+could copy a lock some other thread holds. The forkserver only preloads
+werkzeug.security. Each pool process still imports the main module, like
+spawn does: under gunicorn that is gunicorn itself, with "python app.py"
+it is the app, which skips its startup work there (see start_worker).
+
+stats is exported at /metrics. hashes / hash_seconds is the throughput of
+one pool process.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Too many hashes are already waiting."""
+
+
+def timed(function, *args):
+    """Runs function in the pool process, returns (result, started, seconds)."""
+    started = time.time()
+    result = function(*args)
+    return result, started, time.time() - started
+
+
+def hash_method(pwhash):
+    """'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'"""
+    return pwhash.split("$", 1)[0] if pwhash else ""
+
+
+class PasswordHasher:
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, max_pending=16, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self.executor = None
+        self.executor_pid = None
+        self.executor_lock = threading.Lock()
+        # Hashes submitted and not finished yet
+        self.pending = threading.BoundedSemaphore(max_pending)
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "hashes": 0, "hash_seconds": 0.0, "queue_wait_seconds": 0.0, "rejected": 0, "rehashed": 0,
+        }
+
+    def get_executor(self):
+        """Process pool of the current process, None to hash inline."""
+        if self.workers <= 0:
+            return None
+
+        with self.executor_lock:
+            if self.executor_pid != os.getpid():
+                context = multiprocessing.get_context("forkserver")
+                # Not the default __main__, the forkserver stays free of the app
+                context.set_forkserver_preload(["werkzeug.security"])
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def run(self, function, *args):
+        """Runs a hashing function on the pool, raises PasswordHasherBusy when full."""
+        if not self.pending.acquire(blocking=False):
+            with self.stats_lock:
+                self.stats["rejected"] += 1
+            raise PasswordHasherBusy()
+
+        try:
+            submitted = time.time()
+            executor = self.get_executor()
+            if executor is None:
+                result, started, seconds = timed(function, *args)
+            else:
+                result, started, seconds = executor.submit(timed, function, *args).result(self.timeout)
+        finally:
+            self.pending.release()
+
+        with self.stats_lock:
+            self.stats["hashes"] += 1
+            self.stats["hash_seconds"] += seconds
+            self.stats["queue_wait_seconds"] += max(0.0, started - submitted)
+        return result
+
+    def generate(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def rehash(self, password):
+        """New hash with the configured parameters, for an outdated one."""
+        pwhash = self.generate(password)
+        with self.stats_lock:
+            self.stats["rehashed"] += 1
+        return pwhash
+
+    def needs_rehash(self, pwhash):
+        """True if the hash was made with other parameters than the configured ones."""
+        return hash_method(pwhash) != self.method
@@ -0,0 +1,163 @@
+"""
+Streaming import of old submissions from CSV files.
+
+    flask --app app import-csv blood_donation.csv --mapping blood_donation.json
+
+The CSV is read one row at a time and rows are written batch_size at a
+time with executemany, each batch in its own transaction, so memory stays
+flat however long the file is. Every row goes through the form's
+validators; rejected rows are reported with their line number and are
+not written. Every row becomes a new submission, so importing the same
+file twice adds its rows twice.
+
+The mapping file is JSON:
+
+    {
+        "form": "blood_donor",
+        "columns": {"event": "event_title", "from_date": "from_date", "roll_no": "university_roll_no"},
+        "defaults": {"status": "approved"}
+    }
+
+columns maps CSV headers to field names of the form, or to one of
+"student_id", "email" or "university_roll_no" to find the student the row
+belongs to, or to "status". defaults gives values to targets that no
+column maps to. Files named in file fields are taken as already stored.
+"""
+import csv
+import json
+
+from validators import stored_fields
+
+# Targets that identify the student a row belongs to
+STUDENT_KEYS = ("student_id", "email", "university_roll_no")
+
+
+class MappingError(ValueError):
+    """A mapping file that doesn't fit the form."""
+
+
+def load_mapping(path, form_definitions):
+    """Reads and checks a mapping file, returns it with "student_key" added."""
+    with open(path) as f:
+        mapping = json.load(f)
+
+    form = mapping.get("form")
+    if form not in form_definitions:
+        raise MappingError(f"Unknown form: {form}")
+
+    columns = mapping.get("columns") or {}
+    defaults = mapping.get("defaults") or {}
+    field_names = {field["field_name"] for field in form_definitions[form]["fields"]}
+    targets = set(columns.values()) | set(defaults)
+
+    unknown = targets - field_names - set(STUDENT_KEYS) - {"status"}
+    if unknown:
+        raise MappingError(f"Not fields of {form}: {', '.join(sorted(unknown))}")
+
+    student_keys = [key for key in STUDENT_KEYS if key in targets]
+    if len(student_keys) != 1:
+        raise MappingError(f"Map exactly one column to one of {', '.join(STUDENT_KEYS)}")
+
+    return {"form": form, "columns": columns, "defaults": defaults, "student_key": student_keys[0]}
+
+
+def student_lookup(db, student_key):
+    """
+    Dict from the student key's values to student ids, loaded once.
+    Only students with details can have submissions, the others are left out.
+    Roll numbers aren't unique, the ones shared by several students map to None.
+    """
+    if student_key == "student_id":
+        return {
+            str(row["student_user_id"]): row["student_user_id"]
+            for row in db.execute("SELECT student_user_id FROM student_details")
+        }
+
+    if student_key == "email":
+        return {
+            row["email"].lower(): row["user_id"]
+            for row in db.execute(
+                "SELECT s.user_id, s.email FROM students AS s "
+                "JOIN student_details AS sd ON sd.student_user_id = s.user_id"
+            )
+        }
+
+    lookup = {}
+    for row in db.execute("SELECT student_user_id, university_roll_no FROM student_details"):
+        roll_no = row["university_roll_no"].lower()
+        lookup[roll_no] = None if roll_no in lookup else row["student_user_id"]
+    return lookup
+
+
+def iter_records(csv_file, columns, defaults):
+    """Yields (line number, record) for every row, record maps targets to values."""
+    reader = csv.reader(csv_file)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    targets = [(index, columns[name.strip()]) for index, name in enumerate(header) if name.strip() in columns]
+    missing = set(columns) - {name.strip() for name in header}
+    if missing:
+        raise MappingError(f"Columns not in the CSV: {', '.join(sorted(missing))}")
+
+    line_number = reader.line_num
+    for row in reader:
+        record = dict(defaults)
+        for index, target in targets:
+            if index < len(row):
+                record[target] = row[index]
+        yield line_number + 1, record
+        # A quoted value can span lines, the next row starts after this one
+        line_number = reader.line_num
+
+
+def import_csv(db, form, fields, validator, csv_file, mapping, statuses, batch_size=5000, on_reject=None):
+    """
+    Adds the rows of csv_file to the form's submissions.
+    on_reject(line_number, errors) is called for every rejected row.
+    Returns {"rows", "imported", "rejected"}.
+    """
+    student_key = mapping["student_key"]
+    lookup = student_lookup(db, student_key)
+
+    field_names = [field["field_name"] for field in fields]
+    sql = "INSERT INTO submissions (student_id, form_key, status, fields) VALUES (?, ?, ?, ?)"
+
+    counts = {"rows": 0, "imported": 0, "rejected": 0}
+    batch = []
+
+    def write_batch():
+        with db.transaction():
+            db.executemany(sql, batch)
+        counts["imported"] += len(batch)
+        batch.clear()
+
+    for line_number, record in iter_records(csv_file, mapping["columns"], mapping["defaults"]):
+        counts["rows"] += 1
+
+        values, errors = validator.validate(record, None)
+
+        key = record.get(student_key, "").strip().lower()
+        student_id = lookup.get(key)
+        if student_id is None:
+            reason = "matches more than one student" if key in lookup else "is not a registered student"
+            errors.insert(0, f"{student_key} {key or '(empty)'} {reason}")
+
+        status = record.get("status", "pending").strip().lower() or "pending"
+        if status not in statuses:
+            errors.append(f"Status must be one of {', '.join(statuses)}")
+
+        if errors:
+            counts["rejected"] += 1
+            if on_reject:
+                on_reject(line_number, errors)
+            continue
+
+        batch.append((student_id, form, status, stored_fields(field_names, values)))
+        if len(batch) >= batch_size:
+            write_batch()
+
+    if batch:
+        write_batch()
+    return counts
@@ -0,0 +1,133 @@
+"""
+Append-only CSV journal shared by every worker process.
+
+Rows are not written by the request that submits them. They are queued
+for a writer thread, which waits at most max_delay seconds for more rows,
+then appends the whole batch under an exclusive flock with a single
+write() and one fsync(). Concurrent submitters share that fsync instead
+of each opening, writing and closing the file in turn (group commit), and
+the lock keeps rows from different workers from interleaving.
+
+append() returns once the row is on disk, so a submission is never
+acknowledged before it is durable.
+"""
+import csv
+import fcntl
+import io
+import os
+import threading
+import time
+
+
+def csv_line(row):
+    """One CSV record as bytes, quoted like csv.writer does."""
+    line = io.StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue().encode("utf-8")
+
+
+class CSVJournal:
+
+    def __init__(self, path, header, max_delay=0.01, max_batch=256):
+        self.path = path
+        self.header = csv_line(header)
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+
+        # Rows waiting for the writer, [line, done event, error]
+        self.pending = []
+        self.condition = threading.Condition()
+
+        # Writer thread and file of the current process, started after gunicorn forks
+        self.writer = None
+        self.writer_pid = None
+        self.fd = None
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"rows": 0, "batches": 0, "write_seconds": 0.0, "errors": 0}
+
+    def start_writer(self):
+        with self.condition:
+            if self.writer_pid != os.getpid():
+                self.pending = []
+                self.fd = None
+                self.writer = threading.Thread(target=self.run, name="csv-journal", daemon=True)
+                self.writer.start()
+                self.writer_pid = os.getpid()
+
+    def append(self, row):
+        """Appends a row, returns once it is flushed and fsynced. Raises OSError if it couldn't be."""
+        if self.writer_pid != os.getpid():
+            self.start_writer()
+
+        entry = [csv_line(row), threading.Event(), None]
+        with self.condition:
+            self.pending.append(entry)
+            self.condition.notify()
+
+        entry[1].wait()
+        if entry[2] is not None:
+            raise entry[2]
+
+    def next_batch(self):
+        """Waits for a row, then up to max_delay for others to join its batch."""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+
+            deadline = time.monotonic() + self.max_delay
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            started = time.perf_counter()
+            error = None
+            try:
+                self.write(b"".join(line for line, done, _ in batch))
+            except OSError as e:
+                error = e
+
+            with self.stats_lock:
+                self.stats["rows"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["write_seconds"] += time.perf_counter() - started
+                if error is not None:
+                    self.stats["errors"] += 1
+
+            for entry in batch:
+                entry[2] = error
+                entry[1].set()
+
+    def write(self, data):
+        """Appends data under an exclusive lock, with the header first if the file is empty."""
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                # Checked under the lock, so only one worker writes the header
+                if os.fstat(self.fd).st_size == 0:
+                    data = self.header + data
+
+                view = memoryview(data)
+                while view:
+                    written = os.write(self.fd, view)
+                    view = view[written:]
+                os.fsync(self.fd)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        except OSError:
+            # Opened again for the next batch, the file may have been moved
+            os.close(self.fd)
+            self.fd = None
+            raise
@@ -0,0 +1,48 @@
+"""
+Structured logging for the app, one JSON object per line on stderr.
+
+Every module logs through a child of the "sodeca" logger:
+
+    log = logging.getLogger("sodeca.app")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("certificate saved", extra={"fields": {"file_name": name}})
+
+Extra values go under "fields" and become keys of the JSON object. Calls
+below LOG_LEVEL are dropped by isEnabledFor before anything is built, so
+debug logging on hot paths costs a level check when it is off.
+"""
+import json
+import logging
+import os
+import time
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": os.getpid(),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level):
+    """Sends the "sodeca" loggers to stderr as JSON lines, from level up."""
+    logger = logging.getLogger("sodeca")
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    # Imported again by the flask CLI, don't add a second handler
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        logger.addHandler(handler)
+    # Not repeated by gunicorn's or the root logger's handlers
+    logger.propagate = False
+    return logger
@@ -0,0 +1,229 @@
+"""
+Request metrics in the Prometheus text format, served at /metrics.
+
+RequestTimer wraps the WSGI app and, for every request, records its
+latency by route, method and status, and how many statements went through
+db.execute and how long they took. The time covers opening and saving
+the session and streaming the body, not only the view. Other counters,
+like the session and SQLITE_BUSY stats, are read from the objects that
+keep them when /metrics is scraped.
+
+Every gunicorn worker has its own Metrics. With a metrics folder, each
+worker writes its numbers there every flush_interval seconds, when
+scraped and on exit, and /metrics adds up the files of every worker, live
+or not, so totals don't depend on which worker answers. Empty the folder
+on deploy. Without one, /metrics only shows the worker that answered.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (10 * 1024, 100 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 50 * 1024 ** 2)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+
+    def __init__(self, folder=None, flush_interval=5):
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            # Numbers of the last few seconds aren't lost when the worker stops
+            atexit.register(self.flush)
+
+        # name -> (type, help, buckets)
+        self.definitions = {}
+        self.lock = threading.Lock()
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., sum, count]
+        self.histograms = {}
+        # Functions returning [(name, labels, value)], called on every snapshot
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        self.definitions[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.definitions[name] = ("histogram", help_text, tuple(buckets))
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self.definitions[name][2]
+        key = (name, labels)
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    values[index] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+
+    def snapshot(self):
+        """Current numbers of this process, as JSON-friendly lists."""
+        with self.lock:
+            counters = [[name, labels, value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, list(values)] for (name, labels), values in self.histograms.items()]
+        for collector in self.collectors:
+            counters.extend([name, labels, value] for name, labels, value in collector())
+        return {"counters": counters, "histograms": histograms}
+
+    def maybe_flush(self):
+        """Writes this worker's file when the last one is flush_interval seconds old."""
+        if self.folder and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        path = os.path.join(self.folder, f"worker-{os.getpid()}.json")
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        # Readers never see a half written file
+        os.replace(temporary, path)
+
+    def snapshots(self):
+        """Snapshot of every worker when there is a folder, else of this process."""
+        if not self.folder:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.folder, "worker-*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed or replaced while listing
+                continue
+        return snapshots
+
+    def render(self):
+        """Every metric in the Prometheus text format, summed over workers."""
+        counters = {}
+        histograms = {}
+        for snapshot in self.snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    total[index] += value
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in self.definitions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            if metric_type == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {format_number(value)}")
+                continue
+
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                # Buckets are stored per bucket and reported cumulatively
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), values[:-2] + [values[-1] - sum(values[:-2])]):
+                    cumulative += count
+                    bucket_labels = labels + (("le", format_number(float(bound))),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_number(values[-2])}")
+                lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimer:
+    """WSGI middleware recording each request's latency and SQL statements."""
+
+    def __init__(self, app, metrics, db):
+        self.wsgi_app = app.wsgi_app
+        self.metrics = metrics
+        self.db = db
+
+        metrics.histogram(
+            "sodeca_request_duration_seconds", "Time from receiving a request to sending its last byte.",
+            LATENCY_BUCKETS
+        )
+        metrics.counter("sodeca_requests_total", "Requests answered, by route, method and status.")
+        metrics.histogram("sodeca_request_db_statements", "db.execute calls per request.", STATEMENT_BUCKETS)
+        metrics.histogram(
+            "sodeca_request_db_seconds", "Time spent in db.execute per request.", LATENCY_BUCKETS
+        )
+
+        app.before_request(self.remember_route)
+        app.wsgi_app = self
+
+    def remember_route(self):
+        # URL rule instead of the path, so labels stay few
+        request.environ["sodeca.route"] = request.url_rule.rule if request.url_rule else "unmatched"
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = []
+        self.db.start_tally()
+
+        def timed_start_response(status_line, headers, exc_info=None):
+            status.append(status_line.split(" ", 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            statements, db_seconds = self.db.stop_tally()
+            route = environ.get("sodeca.route", "unmatched")
+            labels = (("route", route), ("method", environ.get("REQUEST_METHOD", "")))
+
+            self.metrics.observe("sodeca_request_duration_seconds", labels, time.perf_counter() - started)
+            self.metrics.inc("sodeca_requests_total", labels + (("status", status[0] if status else "500"),))
+            self.metrics.observe("sodeca_request_db_statements", labels, statements)
+            self.metrics.observe("sodeca_request_db_seconds", labels, db_seconds)
+            self.metrics.maybe_flush()
+
+        try:
+            response = self.wsgi_app(environ, timed_start_response)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(response, finish)
@@ -0,0 +1,479 @@
+"""
+Schema migrations for the SODECA database.
+
+The schema version is stored in the "schema_version" table. Migrations in
+MIGRATIONS are applied in order, each one exactly once. Entries of every
+form in FORM_DEFINITIONS live in the "submissions" table; tables left from
+when each form had its own are moved into it by move_form_tables().
+
+A fingerprint of the migrations and FORM_DEFINITIONS is stored after a
+successful run, when it matches on the next start no DDL is run at all.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+
+log = logging.getLogger("sodeca.migrations")
+
+
+def has_column(db, table, column):
+    return bool(db.execute("SELECT 1 FROM pragma_table_info(?) WHERE name = ?", table, column))
+
+
+def add_column(db, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column is already there."""
+    if not has_column(db, table, column):
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_base_tables(db):
+    """Tables for student logins and student details."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS students (user_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        email TEXT UNIQUE NOT NULL, hash_password TEXT, google_id TEXT UNIQUE,
+        auth_provider TEXT DEFAULT 'local' NOT NULL, profile_picture TEXT,
+        first_name TEXT, last_name TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)
+    """)
+    # roll no. columns is not unique because if one student makes any mistake
+    # that will create hurdles for others
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS student_details(student_user_id INTEGER PRIMARY KEY NOT NULL,
+        university_roll_no TEXT NOT NULL, student_name TEXT NOT NULL, branch TEXT NOT NULL,
+        semester INTEGER NOT NULL, section TEXT NOT NULL, class_group TEXT NOT NULL,
+        batch_counselor TEXT NOT NULL, FOREIGN KEY (student_user_id) REFERENCES students(user_id))
+    """)
+
+
+def create_student_details_index(db):
+    """Index for faculty filters on a batch (counselor, branch, semester, section)."""
+    # students(google_id) and students(email) are UNIQUE, so SQLite already
+    # keeps an index on them for the OAuth and login lookups
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_student_details_batch
+        ON student_details(batch_counselor, branch, semester, section)
+    """)
+
+
+def create_certificates_table(db):
+    """Size, hash and path of every stored certificate."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS certificates (certificate_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        student_id INTEGER NOT NULL, form TEXT NOT NULL, file_name TEXT NOT NULL, path TEXT NOT NULL,
+        size INTEGER NOT NULL, sha256 TEXT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (student_id, form), FOREIGN KEY (student_id) REFERENCES student_details(student_user_id))
+    """)
+
+
+def create_upload_jobs_table(db):
+    """Queue of certificates waiting to be uploaded to Google Drive."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS upload_jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        certificate_id INTEGER NOT NULL, path TEXT NOT NULL, file_name TEXT NOT NULL,
+        status TEXT DEFAULT 'queued' NOT NULL, attempts INTEGER DEFAULT 0 NOT NULL,
+        next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL, drive_file_id TEXT,
+        last_error TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (certificate_id) REFERENCES certificates(certificate_id),
+        CHECK (status IN ('queued', 'uploading', 'done', 'failed')))
+    """)
+    # Workers look for the oldest due job
+    db.execute("CREATE INDEX IF NOT EXISTS idx_upload_jobs_due ON upload_jobs(status, next_attempt_at)")
+    # Upload state shown next to every certificate
+    add_column(db, "certificates", "drive_status", "TEXT")
+    add_column(db, "certificates", "drive_file_id", "TEXT")
+
+
+def create_schema_meta_table(db):
+    """Key/value settings of the schema, like its fingerprint."""
+    db.execute("CREATE TABLE IF NOT EXISTS schema_meta (key TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL)")
+
+
+def create_sessions_table(db):
+    """Server-side sessions, expired rows are found through the expiry index."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY NOT NULL, data BLOB NOT NULL,
+        expiry REAL NOT NULL)
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions(expiry)")
+
+
+def create_submissions_table(db):
+    """
+    One table for the entries of every form, many per student and form.
+    Field values are kept as a JSON object, so forms need no DDL of their own.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS submissions (submission_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        student_id INTEGER NOT NULL, form_key TEXT NOT NULL, status TEXT DEFAULT 'pending' NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        fields TEXT DEFAULT '{}' NOT NULL,
+        FOREIGN KEY (student_id) REFERENCES student_details(student_user_id),
+        CHECK (status IN ('pending', 'approved', 'rejected')), CHECK (json_valid(fields)))
+    """)
+    # Faculty pages of one form, filtered by status, in submission_id order for keyset cursors
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_submissions_form_status
+        ON submissions(form_key, status, submission_id)
+    """)
+    # Every form at once, e.g. all pending submissions
+    db.execute("CREATE INDEX IF NOT EXISTS idx_submissions_status ON submissions(status, submission_id)")
+    # A student's submissions, and batch filters joined through student_details;
+    # covers form_key and status so those rows are never read from the table
+    db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_submissions_student
+        ON submissions(student_id, status, form_key, submission_id)
+    """)
+
+    # Certificates belong to a submission now, rebuilt without UNIQUE (student_id, form)
+    if has_column(db, "certificates", "submission_id"):
+        return
+    db.execute("DROP TABLE IF EXISTS certificates_new")
+    db.execute("""
+        CREATE TABLE certificates_new (certificate_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        submission_id INTEGER, student_id INTEGER NOT NULL, form TEXT NOT NULL, file_name TEXT NOT NULL,
+        path TEXT NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP, drive_status TEXT, drive_file_id TEXT,
+        FOREIGN KEY (submission_id) REFERENCES submissions(submission_id),
+        FOREIGN KEY (student_id) REFERENCES student_details(student_user_id))
+    """)
+    db.execute("""
+        INSERT INTO certificates_new (certificate_id, student_id, form, file_name, path, size, sha256,
+            created_at, drive_status, drive_file_id)
+        SELECT certificate_id, student_id, form, file_name, path, size, sha256,
+            created_at, drive_status, drive_file_id
+        FROM certificates
+    """)
+    db.execute("DROP TABLE certificates")
+    db.execute("ALTER TABLE certificates_new RENAME TO certificates")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_certificates_submission ON certificates(submission_id)")
+
+
+def create_submission_counts_table(db):
+    """
+    Number of submissions per form, status, branch, semester, section and
+    event level, kept up to date by triggers in the same transaction as
+    every change to submissions or to a student's batch.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS submission_counts (form_key TEXT NOT NULL, status TEXT NOT NULL,
+        branch TEXT NOT NULL, semester INTEGER NOT NULL, section TEXT NOT NULL,
+        event_level TEXT NOT NULL, count INTEGER NOT NULL,
+        PRIMARY KEY (form_key, status, branch, semester, section, event_level)) WITHOUT ROWID
+    """)
+
+    # Adds count to the group of a submission, deletes the group when it reaches 0
+    def add(row, count):
+        return f"""
+            INSERT INTO submission_counts
+            SELECT {row}.form_key, {row}.status, sd.branch, sd.semester, sd.section,
+                COALESCE(json_extract({row}.fields, '$.event_level'), ''), {count}
+            FROM student_details AS sd WHERE sd.student_user_id = {row}.student_id
+            ON CONFLICT DO UPDATE SET count = count + excluded.count;
+            DELETE FROM submission_counts
+            WHERE count = 0 AND (form_key, status, branch, semester, section, event_level) IN (
+                SELECT {row}.form_key, {row}.status, sd.branch, sd.semester, sd.section,
+                    COALESCE(json_extract({row}.fields, '$.event_level'), '')
+                FROM student_details AS sd WHERE sd.student_user_id = {row}.student_id
+            );
+        """
+
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS submission_counts_insert AFTER INSERT ON submissions
+        BEGIN {add("NEW", 1)} END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS submission_counts_delete AFTER DELETE ON submissions
+        BEGIN {add("OLD", -1)} END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS submission_counts_update
+        AFTER UPDATE OF student_id, form_key, status, fields ON submissions
+        WHEN OLD.student_id IS NOT NEW.student_id OR OLD.form_key IS NOT NEW.form_key
+            OR OLD.status IS NOT NEW.status
+            OR json_extract(OLD.fields, '$.event_level') IS NOT json_extract(NEW.fields, '$.event_level')
+        BEGIN {add("OLD", -1)} {add("NEW", 1)} END
+    """)
+
+    # A student moved to another branch, semester or section takes their submissions along
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS submission_counts_student_update
+        AFTER UPDATE OF branch, semester, section ON student_details
+        WHEN OLD.branch IS NOT NEW.branch OR OLD.semester IS NOT NEW.semester OR OLD.section IS NOT NEW.section
+        BEGIN
+            UPDATE submission_counts SET count = count - (
+                SELECT COUNT(*) FROM submissions AS s
+                WHERE s.student_id = OLD.student_user_id AND s.form_key = submission_counts.form_key
+                    AND s.status = submission_counts.status
+                    AND COALESCE(json_extract(s.fields, '$.event_level'), '') = submission_counts.event_level
+            )
+            WHERE branch = OLD.branch AND semester = OLD.semester AND section = OLD.section;
+            DELETE FROM submission_counts
+            WHERE count = 0 AND branch = OLD.branch AND semester = OLD.semester AND section = OLD.section;
+            INSERT INTO submission_counts
+            SELECT s.form_key, s.status, NEW.branch, NEW.semester, NEW.section,
+                COALESCE(json_extract(s.fields, '$.event_level'), '') AS event_level, COUNT(*)
+            FROM submissions AS s WHERE s.student_id = NEW.student_user_id
+            GROUP BY s.form_key, s.status, event_level
+            ON CONFLICT DO UPDATE SET count = count + excluded.count;
+        END
+    """)
+
+    # Counts of the submissions already there
+    db.execute("""
+        INSERT INTO submission_counts
+        SELECT s.form_key, s.status, sd.branch, sd.semester, sd.section,
+            COALESCE(json_extract(s.fields, '$.event_level'), '') AS event_level, COUNT(*)
+        FROM submissions AS s JOIN student_details AS sd ON sd.student_user_id = s.student_id
+        GROUP BY s.form_key, s.status, sd.branch, sd.semester, sd.section, event_level
+    """)
+
+
+def create_submissions_search_table(db):
+    """
+    FTS5 index over the text fields of every submission and the name and
+    roll no. of its student, rowid is the submission_id. Triggers keep it
+    in step with submissions and student_details.
+    """
+    db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS submissions_search USING fts5(
+            event_title, event_nature, organizer, venue, student_name, university_roll_no,
+            prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+
+    def index(row):
+        return f"""
+            INSERT INTO submissions_search (rowid, event_title, event_nature, organizer, venue,
+                student_name, university_roll_no)
+            VALUES ({row}.submission_id, json_extract({row}.fields, '$.event_title'),
+                json_extract({row}.fields, '$.event_nature'), json_extract({row}.fields, '$.organizer'),
+                json_extract({row}.fields, '$.venue'),
+                (SELECT student_name FROM student_details WHERE student_user_id = {row}.student_id),
+                (SELECT university_roll_no FROM student_details WHERE student_user_id = {row}.student_id));
+        """
+
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS submissions_search_insert AFTER INSERT ON submissions
+        BEGIN {index("NEW")} END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS submissions_search_delete AFTER DELETE ON submissions
+        BEGIN DELETE FROM submissions_search WHERE rowid = OLD.submission_id; END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS submissions_search_update AFTER UPDATE OF student_id, fields ON submissions
+        BEGIN DELETE FROM submissions_search WHERE rowid = OLD.submission_id; {index("NEW")} END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS submissions_search_student_update
+        AFTER UPDATE OF student_name, university_roll_no ON student_details
+        WHEN OLD.student_name IS NOT NEW.student_name OR OLD.university_roll_no IS NOT NEW.university_roll_no
+        BEGIN
+            UPDATE submissions_search SET student_name = NEW.student_name,
+                university_roll_no = NEW.university_roll_no
+            WHERE rowid IN (SELECT submission_id FROM submissions WHERE student_id = NEW.student_user_id);
+        END
+    """)
+
+    # Submissions already there
+    db.execute("""
+        INSERT INTO submissions_search (rowid, event_title, event_nature, organizer, venue,
+            student_name, university_roll_no)
+        SELECT s.submission_id, json_extract(s.fields, '$.event_title'), json_extract(s.fields, '$.event_nature'),
+            json_extract(s.fields, '$.organizer'), json_extract(s.fields, '$.venue'),
+            sd.student_name, sd.university_roll_no
+        FROM submissions AS s LEFT JOIN student_details AS sd ON sd.student_user_id = s.student_id
+    """)
+
+
+def create_certificate_blobs_table(db):
+    """
+    One row per distinct certificate content, keyed by its sha256, with
+    the path of its only copy on disk and how many certificates use it.
+    Triggers on certificates keep ref_count. Each certificate also gets
+    duplicate_of, the first certificate with the same bytes.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS certificate_blobs (sha256 TEXT PRIMARY KEY NOT NULL, path TEXT NOT NULL,
+        size INTEGER NOT NULL, ref_count INTEGER DEFAULT 0 NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL) WITHOUT ROWID
+    """)
+    add_column(db, "certificates", "duplicate_of", "INTEGER REFERENCES certificates(certificate_id)")
+    # Earliest certificate with the same bytes, looked up on every submission
+    db.execute("CREATE INDEX IF NOT EXISTS idx_certificates_sha256 ON certificates(sha256, certificate_id)")
+
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS certificate_blobs_insert AFTER INSERT ON certificates
+        BEGIN
+            INSERT INTO certificate_blobs (sha256, path, size, ref_count) VALUES (NEW.sha256, NEW.path, NEW.size, 1)
+            ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + 1;
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS certificate_blobs_delete AFTER DELETE ON certificates
+        BEGIN
+            UPDATE certificate_blobs SET ref_count = ref_count - 1 WHERE sha256 = OLD.sha256;
+        END
+    """)
+
+    # Certificates already there, every copy now points at the first one's file
+    # The other copies stay on disk, no row refers to them any more
+    db.execute("""
+        INSERT INTO certificate_blobs (sha256, path, size, ref_count)
+        SELECT c.sha256, c.path, c.size, (SELECT COUNT(*) FROM certificates AS d WHERE d.sha256 = c.sha256)
+        FROM certificates AS c
+        WHERE c.certificate_id = (SELECT MIN(certificate_id) FROM certificates AS d WHERE d.sha256 = c.sha256)
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = excluded.ref_count
+    """)
+    db.execute("""
+        UPDATE certificates SET
+            path = (SELECT path FROM certificate_blobs AS b WHERE b.sha256 = certificates.sha256),
+            duplicate_of = (
+                SELECT MIN(certificate_id) FROM certificates AS d
+                WHERE d.sha256 = certificates.sha256 AND d.certificate_id < certificates.certificate_id
+            )
+    """)
+
+
+# Ordered list of (version, description, function)
+# Never edit or reorder an applied migration, append a new one instead
+MIGRATIONS = [
+    (1, "create students and student_details", create_base_tables),
+    (2, "index student_details for faculty filters", create_student_details_index),
+    (3, "create certificates", create_certificates_table),
+    (4, "create upload_jobs", create_upload_jobs_table),
+    (5, "create schema_meta", create_schema_meta_table),
+    (6, "create sessions", create_sessions_table),
+    (7, "create submissions", create_submissions_table),
+    (8, "create submission_counts", create_submission_counts_table),
+    (9, "create submissions_search", create_submissions_search_table),
+    (10, "create certificate_blobs", create_certificate_blobs_table),
+]
+
+
+# Migrations that drop and recreate a table other tables point at
+TABLE_REBUILDS = {7}
+
+
+def get_schema_version(db):
+    """Returns the current schema version, 0 for a new database."""
+    db.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    rows = db.execute("SELECT MAX(version) AS version FROM schema_version")
+    return rows[0]["version"] or 0
+
+
+def apply_migrations(db):
+    """
+    Applies every migration newer than the current schema version.
+    Workers starting together all get here, each migration takes the write
+    lock and checks the version again, so only the first worker applies it.
+    """
+    current_version = get_schema_version(db)
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        # Table rebuilds run with foreign keys off, which only works outside a transaction,
+        # and are checked before they are committed
+        rebuild = version in TABLE_REBUILDS
+        if rebuild:
+            db.execute("PRAGMA foreign_keys = OFF")
+        try:
+            # Migration and its version number are committed together
+            with db.transaction():
+                current_version = get_schema_version(db)
+                if version <= current_version:
+                    # Applied by another worker meanwhile
+                    continue
+
+                log.info("applying migration", extra={"fields": {"version": version, "description": description}})
+                migration(db)
+                if rebuild and db.execute("PRAGMA foreign_key_check"):
+                    raise sqlite3.IntegrityError(f"migration {version} left rows with missing parents")
+                db.execute("INSERT INTO schema_version (version) VALUES (?)", version)
+        finally:
+            if rebuild:
+                db.execute("PRAGMA foreign_keys = ON")
+
+    return get_schema_version(db)
+
+
+def move_form_tables(db, form_definitions):
+    """
+    Copies the rows of the old per-form tables (one row per student) into
+    submissions, links their certificates, and renames each table to
+    {form}_archive so it is only copied once.
+    """
+    for form in form_definitions:
+        columns = [col["name"] for col in db.execute("SELECT name FROM pragma_table_info(?)", form)]
+        if not columns:
+            continue
+
+        # Every column but the key and status, including fields since removed from the form
+        fields = [col for col in columns if col not in ("student_id", "status")]
+        fields_sql = ", ".join(f"'{field}', {field}" for field in fields)
+
+        with db.transaction():
+            # Moved by another worker meanwhile
+            if not has_column(db, form, "student_id"):
+                continue
+
+            log.info("moving form table into submissions", extra={"fields": {"form": form}})
+            db.execute(f"""
+                INSERT INTO submissions (student_id, form_key, status, fields)
+                SELECT student_id, ?, status, json_object({fields_sql}) FROM {form} ORDER BY student_id
+            """, form)
+            db.execute("""
+                UPDATE certificates SET submission_id = (
+                    SELECT submission_id FROM submissions AS s
+                    WHERE s.student_id = certificates.student_id AND s.form_key = certificates.form
+                )
+                WHERE form = ? AND submission_id IS NULL
+            """, form)
+            db.execute(f"DROP INDEX IF EXISTS idx_{form}_status")
+            db.execute(f"ALTER TABLE {form} RENAME TO {form}_archive")
+
+
+def schema_fingerprint(form_definitions):
+    """Hash of everything the schema is built from."""
+    schema = {
+        "migrations": [version for version, description, migration in MIGRATIONS],
+        "forms": form_definitions,
+    }
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def stored_fingerprint(db):
+    """Fingerprint saved by the last migration run, None if there is none."""
+    try:
+        rows = db.execute("SELECT value FROM schema_meta WHERE key = 'fingerprint'")
+    except sqlite3.OperationalError:
+        # New database, or one from before schema_meta
+        return None
+    return rows[0]["value"] if rows else None
+
+
+def migrate(db, form_definitions):
+    """
+    Brings the database schema up to date.
+    Returns True if anything had to be checked, False if the schema was
+    already built from the same migrations and form definitions.
+    """
+    fingerprint = schema_fingerprint(form_definitions)
+    if stored_fingerprint(db) == fingerprint:
+        return False
+
+    apply_migrations(db)
+    move_form_tables(db, form_definitions)
+    # Statistics for new indexes and moved rows, the planner needs them to pick the right index
+    db.execute("ANALYZE")
+    db.execute(
+        "INSERT INTO schema_meta (key, value) VALUES ('fingerprint', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        fingerprint
+    )
+    return True
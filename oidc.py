@@ -0,0 +1,100 @@
+"""
+Google sign-in with the id_token verified locally.
+
+authorize_access_token() already checks the signed id_token of the token
+response against the provider's JWKS, so the claims it returns replace the
+extra call to the userinfo endpoint. OIDCApp keeps the discovery document
+and the JWKS in a TTLCache instead of authlib's load-once copy, so rotated
+keys are picked up: they are fetched again when their TTL runs out, or
+right away when a token is signed with a key id we don't know yet.
+
+Imported on the first Google login, as authlib is slow to import.
+"""
+import re
+import threading
+import time
+
+from authlib.integrations.flask_client import FlaskOAuth2App
+
+from cache import TTLCache
+
+
+def max_age(response):
+    """max-age of a response's Cache-Control header, None if missing."""
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    return int(match.group(1)) if match else None
+
+
+class OIDCApp(FlaskOAuth2App):
+    """FlaskOAuth2App whose discovery document and JWKS expire."""
+
+    def __init__(self, *args, metadata_ttl=86400, jwks_ttl=3600, jwks_min_refresh=60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metadata_ttl = metadata_ttl
+        self.jwks_ttl = jwks_ttl
+        # Shortest gap between two JWKS fetches for unknown key ids, so
+        # tokens with made up key ids can't make us fetch on every login
+        self.jwks_min_refresh = jwks_min_refresh
+
+        self.documents = TTLCache(max(metadata_ttl, jwks_ttl), maxsize=2)
+        self.fetch_lock = threading.Lock()
+        self.jwks_fetched_at = None
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"metadata_fetches": 0, "jwks_fetches": 0, "jwks_refreshes": 0}
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def fetch_document(self, url):
+        """GETs a JSON document, returns (document, max-age)."""
+        with self.client_cls(**self.client_kwargs) as client:
+            response = client.request("GET", url, withhold_token=True)
+            response.raise_for_status()
+            return response.json(), max_age(response)
+
+    def load_server_metadata(self):
+        if not self._server_metadata_url:
+            return self.server_metadata
+
+        metadata = self.documents.get("metadata")
+        if metadata is None:
+            with self.fetch_lock:
+                metadata = self.documents.get("metadata")
+                if metadata is None:
+                    metadata, _ = self.fetch_document(self._server_metadata_url)
+                    self.documents.set("metadata", metadata, self.metadata_ttl)
+                    self.server_metadata.update(metadata)
+                    self.count("metadata_fetches")
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        """
+        Cached JWKS. force is set by authlib when the token's key id isn't
+        in it, the keys are then fetched again unless they just were.
+        """
+        jwk_set = self.documents.get("jwks")
+        if jwk_set is not None and not force:
+            return jwk_set
+
+        uri = self.load_server_metadata().get("jwks_uri")
+        if not uri:
+            raise RuntimeError('Missing "jwks_uri" in metadata')
+
+        with self.fetch_lock:
+            jwk_set = self.documents.get("jwks")
+            if jwk_set is not None:
+                if not force:
+                    return jwk_set
+                if time.monotonic() - self.jwks_fetched_at < self.jwks_min_refresh:
+                    return jwk_set
+
+            jwk_set, ttl = self.fetch_document(uri)
+            # The provider says how long its keys stay valid, never keep them longer than that
+            ttl = self.jwks_ttl if ttl is None else min(ttl, self.jwks_ttl)
+            self.documents.set("jwks", jwk_set, ttl)
+            self.jwks_fetched_at = time.monotonic()
+
+        self.count("jwks_refreshes" if force else "jwks_fetches")
+        return jwk_set
@@ -0,0 +1,57 @@
+"""
+Full-text search over submissions.
+
+submissions_search (migration 9) is an FTS5 index of each submission's
+event title, nature, organizer and venue and its student's name and roll
+no. Searches are ranked with bm25, matches in the title and the student's
+name and roll no. count the most.
+"""
+import re
+
+# bm25 weights, in the column order of submissions_search
+COLUMN_WEIGHTS = (10.0, 2.0, 1.0, 1.0, 5.0, 5.0)
+
+# Words of the search text, everything else is dropped so the text can't
+# use (or break on) FTS5 query syntax
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def match_query(text):
+    """'Mayukh quiz' -> '"mayukh"* AND "quiz"*', None when there are no words."""
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    return " AND ".join(f'"{word}"*' for word in words)
+
+
+def search_submissions(db, text, filters, limit, offset=0):
+    """
+    Submissions matching every word of text (as a prefix), best first.
+    filters maps SQL columns of submissions "s" and student_details "sd"
+    to the values they must have. Returns limit + 1 rows at most, so the
+    caller knows whether there is another page.
+    """
+    query = match_query(text)
+    if query is None:
+        return []
+
+    where_list = ["submissions_search MATCH ?"]
+    params = [query]
+    for column, value in filters.items():
+        where_list.append(f"{column} = ?")
+        params.append(value)
+
+    weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+    sql = f"""
+        SELECT s.submission_id, s.student_id, s.form_key, s.status, s.created_at, s.fields,
+            sd.university_roll_no, sd.student_name, sd.branch, sd.semester, sd.section,
+            sd.class_group, sd.batch_counselor, bm25(submissions_search, {weights}) AS rank
+        FROM submissions_search
+        JOIN submissions AS s ON s.submission_id = submissions_search.rowid
+        JOIN student_details AS sd ON sd.student_user_id = s.student_id
+        WHERE {' AND '.join(where_list)}
+        ORDER BY rank, s.submission_id
+        LIMIT ? OFFSET ?
+    """
+    params.extend([limit + 1, offset])
+    return db.execute(sql, *params)
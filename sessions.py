@@ -0,0 +1,165 @@
+"""
+Server-side sessions stored in the SQLite database.
+
+Used instead of Flask-Session's filesystem backend when SESSION_TYPE is
+"sqlite". Sessions live in the "sessions" table with an indexed expiry
+column, a background thread deletes expired rows in batches, and an
+optional in-process cache skips the database on repeated reads.
+
+Load and save times are counted in SQLiteSessionInterface.stats.
+"""
+import logging
+import threading
+import time
+
+from flask_session._utils import total_seconds
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+from flask_session.defaults import Defaults
+
+from cache import TTLCache
+
+log = logging.getLogger("sodeca.sessions")
+
+
+class SQLiteSession(ServerSideSession):
+    pass
+
+
+class SQLiteSessionInterface(ServerSideSessionInterface):
+
+    session_class = SQLiteSession
+    # Expired rows are removed by our own sweeper, not by Flask-Session
+    ttl = True
+
+    def __init__(
+        self,
+        app,
+        db,
+        key_prefix=Defaults.SESSION_KEY_PREFIX,
+        permanent=Defaults.SESSION_PERMANENT,
+        sid_length=Defaults.SESSION_ID_LENGTH,
+        serialization_format=Defaults.SESSION_SERIALIZATION_FORMAT,
+        cache_ttl=0,
+        cache_size=1024,
+        refresh_after=300,
+        sweep_interval=300,
+        sweep_batch=1000,
+    ):
+        super().__init__(
+            app, key_prefix, False, permanent, sid_length, serialization_format
+        )
+        self.db = db
+        self.lifetime = total_seconds(app.permanent_session_lifetime)
+
+        # store_id -> (serialized data, expiry), read-through
+        # Only safe when a user's requests always reach the same worker
+        self.cache = TTLCache(cache_ttl, cache_size)
+
+        # store_id -> expiry last written, unchanged sessions are only
+        # written again once their expiry is refresh_after seconds old
+        self.refresh_after = refresh_after
+        self.written_expiry = TTLCache(refresh_after, cache_size)
+
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.sweeper = None
+        self.stop_event = threading.Event()
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "loads": 0, "load_seconds": 0.0, "cache_hits": 0,
+            "saves": 0, "save_seconds": 0.0, "saves_skipped": 0, "swept": 0,
+        }
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def _retrieve_session_data(self, store_id):
+        started = time.perf_counter()
+        now = time.time()
+
+        cached = self.cache.get(store_id)
+        if cached is not None and cached[1] > now:
+            self.count("cache_hits")
+            data = cached[0]
+        else:
+            rows = self.db.execute(
+                "SELECT data, expiry FROM sessions WHERE id = ? AND expiry > ?", store_id, now
+            )
+            if not rows:
+                self.count("loads")
+                self.count("load_seconds", time.perf_counter() - started)
+                return None
+
+            data = rows[0]["data"]
+            self.cache.set(store_id, (data, rows[0]["expiry"]))
+            self.written_expiry.set(store_id, rows[0]["expiry"])
+
+        session_data = self.serializer.decode(data)
+        self.count("loads")
+        self.count("load_seconds", time.perf_counter() - started)
+        return session_data
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        started = time.perf_counter()
+        now = time.time()
+        lifetime = total_seconds(session_lifetime)
+
+        # Unchanged and its expiry was pushed forward recently, nothing to write
+        if not session.modified:
+            written = self.written_expiry.get(store_id)
+            if written is not None and written - now > lifetime - self.refresh_after:
+                self.count("saves_skipped")
+                return
+
+        data = self.serializer.encode(session)
+        expiry = now + lifetime
+        self.db.execute(
+            """
+            INSERT INTO sessions (id, data, expiry) VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET data = excluded.data, expiry = excluded.expiry
+            """,
+            store_id, data, expiry
+        )
+        self.cache.set(store_id, (data, expiry))
+        self.written_expiry.set(store_id, expiry)
+
+        self.count("saves")
+        self.count("save_seconds", time.perf_counter() - started)
+
+    def _delete_session(self, store_id):
+        self.db.execute("DELETE FROM sessions WHERE id = ?", store_id)
+        self.cache.pop(store_id)
+        self.written_expiry.pop(store_id)
+
+    def _delete_expired_sessions(self):
+        """Deletes expired sessions, sweep_batch rows per statement."""
+        total = 0
+        while True:
+            deleted = self.db.execute(
+                """
+                DELETE FROM sessions WHERE id IN (
+                    SELECT id FROM sessions WHERE expiry <= ? LIMIT ?
+                )
+                """,
+                time.time(), self.sweep_batch
+            )
+            total += deleted
+            if deleted < self.sweep_batch:
+                break
+
+        self.count("swept", total)
+        return total
+
+    def start_sweeper(self):
+        """Deletes expired sessions every sweep_interval seconds in a background thread."""
+        def sweep():
+            while not self.stop_event.wait(self.sweep_interval):
+                try:
+                    self._delete_expired_sessions()
+                except Exception:
+                    log.exception("session sweep failed")
+
+        self.sweeper = threading.Thread(target=sweep, name="session-sweeper", daemon=True)
+        self.sweeper.start()
@@ -39,35 +39,83 @@ function updateSummaryDisplay() {
 /**
  * Handles the form submission, preventing it if no items are selected.
  */
-document.getElementById('college-form').addEventListener('submit', function(event) {
-    if (selectedForms.size === 0) {
-        event.preventDefault(); // Stop the form from submitting
-        alert('Please select at least one form before proceeding.');
+const collegeForm = document.getElementById('college-form');
+if (collegeForm) {
+    collegeForm.addEventListener('submit', function(event) {
+        if (selectedForms.size === 0) {
+            event.preventDefault(); // Stop the form from submitting
+            alert('Please select at least one form before proceeding.');
+            return;
+        }
+    });
+}
+
+/**
+ * Sends status changes for many rows in one request and updates the rows in place.
+ * @param {HTMLTableRowElement[]} rows - Rows of the submissions table to change.
+ * @param {string} status - "approved" or "rejected".
+ */
+function updateStatus(rows, status) {
+    if (rows.length === 0) {
         return;
     }
-});
+
+    var updates = rows.map(row => ({
+        submission_id: Number(row.dataset.submissionId),
+        status: status,
+    }));
+
+    fetch('/update_sheets', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({updates: updates})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+            return;
+        }
+        // Only the changed rows are returned, update just those
+        data.updated.forEach(change => {
+            var row = document.querySelector(`tr[data-submission-id="${change.submission_id}"]`);
+            if (!row) {
+                return;
+            }
+            var buttonClass = change.status === 'approved' ? 'btn-success' : 'btn-danger';
+            row.querySelector('.status-cell').innerHTML =
+                `<button class="btn ${buttonClass}" disabled>${change.status}</button>`;
+            var checkbox = row.querySelector('.select-row');
+            if (checkbox) {
+                checkbox.remove();
+            }
+        });
+    })
+    .catch(error => {
+        console.error('Error:', error);
+    });
+}
 
 document.querySelectorAll('.process-btn').forEach(button => {
     button.addEventListener('click', function() {
-        var row = this.closest('tr');
-        var rowData = {
-            form_name: row.dataset.formName,
-            student_id: row.dataset.studentId,
-        };
-        
-        fetch('/update_sheets', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(rowData)
-        })
-        .then(response => response.json())
-        .then(data => {
-            location.reload(); // refresh the page
-        })
-        .catch(error => {
-            console.error('Error:', error);
+        updateStatus([this.closest('tr')], this.dataset.status);
+    });
+});
+
+document.querySelectorAll('.bulk-btn').forEach(button => {
+    button.addEventListener('click', function() {
+        var card = this.closest('.card');
+        var rows = [...card.querySelectorAll('.select-row:checked')].map(checkbox => checkbox.closest('tr'));
+        updateStatus(rows, this.dataset.status);
+    });
+});
+
+document.querySelectorAll('.select-all').forEach(checkbox => {
+    checkbox.addEventListener('change', function() {
+        this.closest('table').querySelectorAll('.select-row').forEach(row => {
+            row.checked = this.checked;
         });
     });
-});
\ No newline at end of file
+});
@@ -0,0 +1,152 @@
+"""
+On-disk storage for uploaded certificates.
+
+Uploads are copied to UPLOAD_FOLDER in fixed-size chunks and hashed in the
+same pass. Each file is written to a temporary file first and renamed into
+place only when it is complete, so a crash never leaves a half-written
+certificate behind.
+
+Files are named by their sha256, UPLOAD_FOLDER/ab/abcdef..., so identical
+certificates share one file. The certificate_blobs table counts the
+certificates using each file, plus one for every upload not stored yet.
+Files are only put in place or removed under the database's write lock,
+together with their count, so a file is never removed while an upload in
+another worker is about to use it. Files no one uses any more are removed
+by prune_blobs.
+"""
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+
+# Bytes read from the upload at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_path(upload_folder, sha256):
+    """Where the file with this sha256 hex digest is stored."""
+    return os.path.join(upload_folder, sha256[:2], sha256)
+
+
+def save_upload(db, file_storage, upload_folder, chunk_size=CHUNK_SIZE):
+    """
+    Streams an uploaded file to upload_folder, under its sha256, and takes
+    a reference on its certificate_blobs row. The caller hands it over to
+    the certificate with release_upload, or gives it back with discard_upload.
+    Returns a dict with the path, size in bytes, sha256 hex digest and
+    created, False if a file with the same bytes was already there.
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    size = 0
+
+    # Temporary file in the same folder, so the rename below is atomic
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, prefix=".upload_", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                chunk = file_storage.stream.read(chunk_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+
+            # Make sure the bytes are on disk before the file gets its name
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        # The name is only known once the file is read, an identical file
+        # already there is replaced by the same bytes
+        path = blob_path(upload_folder, sha256.hexdigest())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with db.transaction():
+            db.execute(
+                """
+                INSERT INTO certificate_blobs (sha256, path, size, ref_count) VALUES (?, ?, ?, 1)
+                ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + 1
+                """,
+                sha256.hexdigest(), path, size
+            )
+            created = not os.path.exists(path)
+            os.replace(temp_path, path)
+    except BaseException:
+        # Never leave partial files around
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return {"path": path, "size": size, "sha256": sha256.hexdigest(), "created": created}
+
+
+def release_upload(db, stored):
+    """
+    Drops the reference save_upload took, once the certificate's own is
+    counted. Runs in the transaction that inserts the certificate.
+    """
+    db.execute("UPDATE certificate_blobs SET ref_count = ref_count - 1 WHERE sha256 = ?", stored["sha256"])
+
+
+def discard_upload(db, stored):
+    """
+    Gives back the reference save_upload took, for a submission that
+    wasn't stored, and removes the file if no one else uses it.
+    """
+    with db.transaction():
+        release_upload(db, stored)
+        remove_unused_blob(db, stored["sha256"], stored["path"])
+
+
+def remove_unused_blob(db, sha256, *paths):
+    """
+    Deletes the certificate_blobs row of sha256 and its file, with paths
+    too, if nothing refers to it. Called inside a write transaction.
+    Returns True if it was removed.
+    """
+    rows = db.execute("SELECT path FROM certificate_blobs WHERE sha256 = ? AND ref_count <= 0", sha256)
+    if not rows:
+        return False
+
+    db.execute("DELETE FROM certificate_blobs WHERE sha256 = ?", sha256)
+    for path in {rows[0]["path"], *paths}:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return True
+
+
+def prune_blobs(db):
+    """
+    Deletes the certificate_blobs rows no certificate uses any more, and
+    their files. Returns the number of rows removed.
+    """
+    removed = 0
+    with db.transaction():
+        for blob in db.execute("SELECT sha256 FROM certificate_blobs WHERE ref_count <= 0"):
+            removed += remove_unused_blob(db, blob["sha256"])
+    return removed
+
+
+def remove_partial_uploads(upload_folder, max_age=3600):
+    """
+    Deletes temporary files left by uploads interrupted by a crash.
+    Only files older than max_age seconds are removed, other workers may
+    still be writing the newer ones.
+    """
+    if not os.path.isdir(upload_folder):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for name in os.listdir(upload_folder):
+        if name.startswith(".upload_") and name.endswith(".part"):
+            temp_path = os.path.join(upload_folder, name)
+            try:
+                if now - os.path.getmtime(temp_path) > max_age:
+                    os.remove(temp_path)
+                    removed += 1
+            except FileNotFoundError:
+                # Finished or removed by another worker meanwhile
+                pass
+    return removed
@@ -0,0 +1,42 @@
+"""
+Request size limits and spooling for multipart uploads.
+
+Each form's limit is the max_size of its file fields plus a small
+allowance for its other fields and the multipart headers. fill_form sets
+it as request.max_content_length before the body is read, and Werkzeug
+enforces it while the body streams: a Content-Length above the limit is
+refused before a byte is read, a chunked body is cut off as soon as it
+crosses the limit. Either way the client gets a 413.
+
+Uploaded files stay in memory up to spool_threshold bytes and go to a
+temporary file past that, so a worker holds at most that much of each
+file in memory whatever its size.
+"""
+from tempfile import SpooledTemporaryFile
+
+from flask import Request
+
+from validators import parse_size
+
+
+def upload_limits(form_definitions, default_max_size, overhead):
+    """Largest request body each form can need, {form: bytes}."""
+    limits = {}
+    for form, definition in form_definitions.items():
+        total = overhead
+        for field in definition["fields"]:
+            if field["field_type"] == "file":
+                total += parse_size(field.get("validation", {}).get("max_size", default_max_size))
+        limits[form] = total
+    return limits
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files are spooled to disk past spool_threshold bytes."""
+
+    spool_threshold = 64 * 1024
+    # None for the system's temporary folder
+    spool_folder = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=self.spool_threshold, mode="rb+", dir=self.spool_folder)
@@ -0,0 +1,233 @@
+"""
+Validators compiled from FORM_DEFINITIONS.
+
+compile_forms() turns every form definition into a FormValidator once, at
+startup. Each field becomes a parser plus a list of checks with their limits
+already bound, so validating a submission is a single pass over the fields
+that collects every error instead of stopping at the first one.
+
+Rules understood:
+    field_validation: min_length, max_length, min, max,
+                      max_date ('today' or 'YYYY-MM-DD'), after_field
+    validation (files): accepted_types, max_size ('5MB')
+"""
+from datetime import date, datetime
+import json
+import math
+import os
+import re
+
+DATE_FORMAT = "%Y-%m-%d"
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+class ValidationError(ValueError):
+    """A value that doesn't follow its field's rules."""
+
+
+def parse_size(size):
+    """'5MB' -> 5242880, numbers are taken as bytes."""
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?B)\s*", size.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def upload_name(value):
+    """File name of an upload, or the value itself when it names a file stored before."""
+    return value if isinstance(value, str) else value.filename
+
+
+def file_size(file_storage):
+    """Size of an uploaded file in bytes, without reading it."""
+    stream = file_storage.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+# Parsers, each turns the submitted value into a python value or raises ValidationError
+
+def parse_text(value):
+    return value.strip()
+
+
+def parse_number(value):
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValidationError("must be a number")
+    # float() takes "nan" and "inf", which no min or max would catch
+    if not math.isfinite(number):
+        raise ValidationError("must be a number")
+    return int(number) if number.is_integer() else number
+
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def parse_date(value):
+    # Same as strptime with DATE_FORMAT, several times faster on big imports
+    try:
+        if not DATE_PATTERN.fullmatch(value):
+            raise ValueError
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError("must be a date (YYYY-MM-DD)")
+
+
+PARSERS = {
+    "number": parse_number,
+    "date": parse_date,
+}
+
+
+def max_date_limit(max_date):
+    """Function returning the latest allowed date, 'today' is checked on every call."""
+    if max_date == "today":
+        return date.today
+    limit = datetime.strptime(max_date, DATE_FORMAT).date()
+    return lambda: limit
+
+
+def compile_field(field, default_extensions):
+    """Returns a list of checks, each check(value) returns an error or None."""
+    rules = field.get("field_validation", {})
+    file_rules = field.get("validation", {})
+    checks = []
+
+    if "min_length" in rules:
+        min_length = rules["min_length"]
+        checks.append(lambda value: f"must be at least {min_length} characters"
+                      if len(value) < min_length else None)
+
+    if "max_length" in rules:
+        max_length = rules["max_length"]
+        checks.append(lambda value: f"must be at most {max_length} characters"
+                      if len(value) > max_length else None)
+
+    if "min" in rules:
+        minimum = rules["min"]
+        checks.append(lambda value: f"must be at least {minimum}" if value < minimum else None)
+
+    if "max" in rules:
+        maximum = rules["max"]
+        checks.append(lambda value: f"must be at most {maximum}" if value > maximum else None)
+
+    if "max_date" in rules:
+        limit = max_date_limit(rules["max_date"])
+        checks.append(lambda value: f"can't be after {limit().isoformat()}" if value > limit() else None)
+
+    if field.get("options"):
+        options = {option["value"] for option in field["options"]}
+        checks.append(lambda value: "is not one of the choices" if value not in options else None)
+
+    if field["field_type"] == "file":
+        accepted_types = file_rules.get("accepted_types") or [f".{ext}" for ext in default_extensions]
+        accepted_types = {ext.lower() for ext in accepted_types}
+        checks.append(lambda value: f"must be one of {', '.join(sorted(accepted_types))}"
+                      if os.path.splitext(upload_name(value))[1].lower() not in accepted_types else None)
+
+        if "max_size" in file_rules:
+            max_size = parse_size(file_rules["max_size"])
+            # Stored files were checked when they were uploaded
+            checks.append(lambda value: f"must be smaller than {file_rules['max_size']}"
+                          if not isinstance(value, str) and file_size(value) > max_size else None)
+
+    return checks
+
+
+def stored_value(value):
+    """Parsed value as kept in submissions.fields: dates as YYYY-MM-DD, files by name."""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (str, int, float)):
+        return value
+    return value.filename
+
+
+def stored_fields(field_names, values):
+    """JSON for submissions.fields, fields left empty are stored as ''."""
+    return json.dumps({name: stored_value(values[name]) if name in values else "" for name in field_names})
+
+
+class FormValidator:
+    """Precompiled checks of one form."""
+
+    def __init__(self, form_definition, default_extensions=()):
+        self.fields = []
+        self.cross_checks = []
+
+        for field in form_definition["fields"]:
+            name = field["field_name"]
+            parser = PARSERS.get(field["field_type"], parse_text)
+            self.fields.append((
+                name, field["field_label"], field["field_type"], field.get("required", False),
+                parser, compile_field(field, default_extensions),
+            ))
+
+            # Checks that compare two fields run once both are parsed
+            after_field = field.get("field_validation", {}).get("after_field")
+            if after_field:
+                self.cross_checks.append((name, field["field_label"], after_field))
+
+        self.labels = {name: label for name, label, *rest in self.fields}
+
+    def validate(self, form_data, files):
+        """
+        Validates a submission in one pass.
+        Returns (values, errors): values maps field names to parsed values
+        (FileStorage for files), errors is a list of messages.
+        With files=None, file fields are names of stored files read from
+        form_data, as in imported records.
+        """
+        values = {}
+        errors = []
+
+        for name, label, field_type, required, parser, checks in self.fields:
+
+            if field_type == "file" and files is not None:
+                raw = files.get(name)
+                missing = raw is None or raw.filename == ""
+            else:
+                raw = form_data.get(name, "")
+                missing = raw.strip() == ""
+
+            if missing:
+                if required:
+                    errors.append(f"{label} is missing")
+                continue
+
+            try:
+                value = raw if field_type == "file" else parser(raw)
+            except ValidationError as e:
+                errors.append(f"{label} {e}")
+                continue
+
+            field_errors = [error for check in checks if (error := check(value))]
+            if field_errors:
+                errors.extend(f"{label} {error}" for error in field_errors)
+                continue
+
+            values[name] = value
+
+        for name, label, after_field in self.cross_checks:
+            # Only compared when both fields are valid
+            if name in values and after_field in values and values[name] < values[after_field]:
+                errors.append(f"{label} can't be before {self.labels[after_field]}")
+
+        return values, errors
+
+
+def compile_forms(form_definitions, default_extensions=()):
+    """FormValidator for every form, by form name."""
+    return {
+        form: FormValidator(form_definition, default_extensions)
+        for form, form_definition in form_definitions.items()
+    }